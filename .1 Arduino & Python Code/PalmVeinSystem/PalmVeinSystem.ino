@@ -26,6 +26,7 @@ void setup() {
 
   // Initial State
   displayScreen("PALMPASS", "WAITING...");
+  Serial.println("READY"); // Host waits for this after opening the port resets the board
 }
 
 // ==========================================
@@ -62,13 +63,13 @@ void handleSerialCommand() {
     String data = (separatorIndex == -1) ? "" : input.substring(separatorIndex + 1);
 
     // --- HARDWARE CONTROL ---
-    if (cmd == "IR_ON") { ledcWrite(MOSFET_PIN, 255); return; }
-    if (cmd == "IR_OFF") { ledcWrite(MOSFET_PIN, 0); return; }
+    if (cmd == "IR_ON") { ledcWrite(MOSFET_PIN, 255); }
+    else if (cmd == "IR_OFF") { ledcWrite(MOSFET_PIN, 0); }
     
     // --- DISPLAY LOGIC ---
     
     // 1. IDLE
-    if (cmd == "IDLE") {
+    else if (cmd == "IDLE") {
       displayScreen("PALMPASS", "WAITING...");
     }
     
@@ -122,6 +123,9 @@ void handleSerialCommand() {
     else if (cmd == "PROCESSING") {
       displayScreen("PROCESSING", "PLEASE WAIT...");
     }
+
+    // Acknowledge once the command has been applied
+    Serial.println("ACK:" + cmd);
   }
 }
 
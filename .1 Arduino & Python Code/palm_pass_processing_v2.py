@@ -1,4 +1,13 @@
+import time
+PROCESS_START = time.perf_counter()  # Reference point for the startup timeline
+
 import os
+import sys
+import argparse
+import importlib
+import importlib.util
+import itertools
+import csv
 import logging
 import warnings
 
@@ -11,59 +20,121 @@ os.environ["OPENCV_FFMPEG_LOGLEVEL"] = "0"
 
 warnings.filterwarnings('ignore')
 
-import absl.logging
-absl.logging.set_verbosity(absl.logging.ERROR)
-
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import cv2
 import numpy as np
 import serial
 import threading
-import time
 import json
 import shutil
+import sqlite3
+import uuid
 import urllib.request
 from collections import deque
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from pathlib import Path
 from PIL import Image, ImageTk
 
+class LazyModule:
+    """Imports a module on first attribute access, keeping heavy imports off the startup path."""
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_import: self._on_import()
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr): return getattr(self.load(), attr)
+
+def _silence_absl():
+    import absl.logging
+    absl.logging.set_verbosity(absl.logging.ERROR)
+
 # --- MediaPipe ---
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
+mp = LazyModule("mediapipe", on_import=_silence_absl)
 
 # --- Scientific Image Processing ---
-try:
-    from skimage.morphology import skeletonize, remove_small_objects, thin
-    HAS_SKIMAGE = True
-except ImportError:
-    HAS_SKIMAGE = False
-    print("WARNING: scikit-image not found. Run 'pip install scikit-image'")
+HAS_SKIMAGE = importlib.util.find_spec("skimage") is not None
+if not HAS_SKIMAGE: print("WARNING: scikit-image not found. Run 'pip install scikit-image'")
+morphology = LazyModule("skimage.morphology")
 
 # --- Firebase ---
-import firebase_admin
-from firebase_admin import credentials, firestore
+firebase_admin = LazyModule("firebase_admin")
+credentials = LazyModule("firebase_admin.credentials")
+firestore = LazyModule("firebase_admin.firestore")
+google_exceptions = LazyModule("google.api_core.exceptions")
 
 # ==================== CONFIGURATION ====================
 ESP_IP = "192.168.1.40"
 CAPTURE_URL = f"http://{ESP_IP}/capture"
 STREAM_URL_PRIMARY = f"http://{ESP_IP}:81/stream"   # Fast Stream
+STREAM_URL_BACKUP = f"http://{ESP_IP}/stream"       # Fallback
+STREAM_STALL_TIMEOUT = 3.0  # Seconds without a frame before the stream is reconnected
+STREAM_BACKOFF_BASE = 0.5   # First reconnect delay, doubled per failed attempt
+STREAM_BACKOFF_MAX = 8.0
 CAPTURE_SIZE = "UXGA"  # High res for capture
 PREVIEW_SCALE = 1.0    
 SERIAL_PORT = "COM8"
 SERIAL_BAUD = 115200
+LCD_RESET_WAIT = 2.0     # Max seconds to wait for the board's READY after opening the port resets it
+LCD_ACK_TIMEOUT = 0.3    # Seconds to wait for ACK:<command> after each write
+LCD_QUEUE_MAX = 8        # Commands held while the port is busy or reconnecting; oldest dropped beyond this
 
 DATABASE_DIR = Path("vein_database_hybrid")
 TEMPLATES_DIR = DATABASE_DIR / "templates"
-INDEX_FILE = DATABASE_DIR / "student_index.json"
+INDEX_FILE = DATABASE_DIR / "student_index.json"   # Legacy index, migrated into the packed store
+COMPACT_DEAD_ROWS = 256   # Deleted template rows tolerated before the store is rewritten (and on shutdown)
 DATABASE_DIR.mkdir(exist_ok=True)
 TEMPLATES_DIR.mkdir(exist_ok=True)
-
+WRITE_JOURNAL = DATABASE_DIR / "pending_writes.sqlite"   # Firestore writes not yet acknowledged by the server
+FIRESTORE_BATCH_MAX = 500     # Firestore's per-batch write limit
+FIRESTORE_FLUSH_DELAY = 0.2   # Seconds to coalesce queued writes into one batch
+FIRESTORE_RETRY_MAX = 30.0    # Backoff ceiling while Firestore is unreachable
+BATHROOM_ALERT_MINUTES = 10   # Highlight students out longer than this in the "Currently Out" list
+
+ROI_SIZE = 400        # Side of the normalized vein ROI
+VECTOR_GRIDS = (32,)  # Density grid sizes on the ROI_SIZE skeleton
+VECTOR_DIM = 2 + sum(((ROI_SIZE + g - 1) // g) ** 2 for g in VECTOR_GRIDS)   # 171: 2 minutiae counts + 13x13 densities
 MATCH_THRESHOLD = 0.70
+MATCH_INDEX = "exact"   # "exact" linear scan or "ivf" approximate search for large galleries
+IVF_PROBES = None       # Inverted lists scanned per query by the ivf index; None = calibrated to IVF_RECALL_TARGET
+IVF_RECALL_TARGET = 0.95   # Share of jittered enrolled templates whose nearest row the calibrated probes must reach
 CAPTURE_COOLDOWN = 3.0 
+PREFETCH_STABLE_FRAMES = 3  # Stable frames before an HD capture is prefetched (is_ready() needs 6)
+PREFETCH_MAX_AGE = 1.5      # Seconds a prefetched capture stays usable
+TRACK_RESULT_MAX_AGE = 0.5  # Seconds before a tracking result is too old to draw or act on
+ADAPTIVE_TRACKING = False   # Re-detect on a crop around the last box and skip frames while the hand is still
+TRACK_STABLE_STRIDE = 2     # While stable, run inference on 1 of every N preview frames
+TRACK_CROP_MARGIN = 0.5     # Crop = last box grown by this fraction of its longer side on each edge
+STABLE_WINDOW = 4           # Tracked frames of landmark history used for the motion check
+STABLE_MIN_IOU = 0.80       # Hand extent must overlap the previous frame's by at least this much
+STABLE_MAX_SPEED = 0.06     # Max palm-centre drift per frame, as a fraction of palm length
+STABLE_MAX_SCALE = 0.10     # Max palm length change across the window (hand moving to/from the lens)
+REDUCED_DECODE = False    # Decode captures at 1/2-1/8 scale when the hand crop still covers ROI_SIZE
+FAST_ROI = False          # Warp the ROI straight from the capture and denoise only the ROI_SIZE result
+FAST_ROI_BILATERAL_D = 5  # Bilateral diameter on the ROI_SIZE ROI (9 at full crop resolution)
+FAST_ROI_TOLERANCE = 0.90 # Minimum cosine similarity to the full-res vector (--check-fast-roi)
+STATION_POLL_INTERVAL = 0.02   # Seconds between passes over the stations' tracking results (--stations)
+SERVICE_HOST = "127.0.0.1"   # Headless matching service (--serve)
+SERVICE_PORT = 8700
+AUTOSTART_STREAM = False   # Start the preview as soon as the window is up (startup timing runs)
+PROFILE_STAGES = False    # Per-stage extraction timings in the status bar
+PROFILE_OUT = None        # Optional .json or .prom file rewritten after every capture
 FIREBASE_CRED_PATH = "INSERT_YOUR_FIREBASE_CREDENTIALS_FILE_PATH"
 
 FACULTY_DATA = [
@@ -78,7 +149,8 @@ FACULTY_DATA = [
 
 # ==================== GLOBAL VARS & HELPERS ====================
 db = None
-ser = None
+lcd = None
+writer = None
 
 def init_firebase():
     global db
@@ -90,32 +162,350 @@ def init_firebase():
         return True
     except: return False
 
-def init_serial():
-    global ser
-    try:
-        ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=1)
-        time.sleep(2)
-        return True
-    except: return False
+class LcdWriter:
+    """Owns the LCD board's serial port on one thread so callers never block on it.
+
+    Commands wait in a small queue while the port opens, the board resets or a write is in flight. A new
+    command cancels queued commands for the same output that are scheduled after it (a delayed IDLE behind
+    a newer ATTENDANCE) or that are already overdue, so the screen never replays stale states.
+    """
+    def __init__(self, port=SERIAL_PORT, baud=SERIAL_BAUD, reset_wait=LCD_RESET_WAIT, ack_timeout=LCD_ACK_TIMEOUT,
+                 maxsize=LCD_QUEUE_MAX):
+        self.port = port
+        self.baud = baud
+        self.reset_wait = reset_wait
+        self.ack_timeout = ack_timeout
+        self.maxsize = maxsize
+        self.queue = []          # (due, channel, line), kept in due order
+        self.cond = threading.Condition()
+        self.ser = None
+        self.ready = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {"sent": 0, "acked": 0, "coalesced": 0, "dropped": 0, "reconnects": 0}
 
-def send_lcd_command(command, data=""):
-    """Sends command in format COMMAND:DATA\n"""
-    global ser
-    if ser and ser.is_open:
-        try: ser.write(f"{command}:{data}\n".encode())
+    @staticmethod
+    def channel(command): return "ir" if command.startswith("IR_") else "display"
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def send(self, command, data="", delay=0.0):
+        now = time.monotonic()
+        due = now + delay
+        channel = self.channel(command)
+        with self.cond:
+            kept = [item for item in self.queue
+                    if item[1] != channel or not (item[0] >= due or (delay <= 0 and item[0] <= now))]
+            self.stats["coalesced"] += len(self.queue) - len(kept)
+            if len(kept) >= self.maxsize:
+                kept.pop(0)
+                self.stats["dropped"] += 1
+            kept.append((due, channel, f"{command}:{data}\n".encode()))
+            kept.sort(key=lambda item: item[0])
+            self.queue = kept
+            self.cond.notify()
+
+    def _open(self):
+        self.ser = serial.Serial(self.port, self.baud, timeout=self.ack_timeout, write_timeout=1)
+        # Opening the port resets the board; it prints READY once setup() is done (older firmware stays silent)
+        deadline = time.monotonic() + self.reset_wait
+        while time.monotonic() < deadline and not self.stop_event.is_set():
+            if self.ser.readline().strip() == b"READY": break
+        self.ser.reset_input_buffer()
+        self.ready.set()
+
+    def _close(self):
+        self.ready.clear()
+        try: self.ser.close()
         except: pass
+        self.ser = None
+
+    def _run(self):
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            if self.ser is None:
+                try:
+                    self._open()
+                    backoff = 1.0
+                except (serial.SerialException, OSError):
+                    self.ser = None
+                    self.stop_event.wait(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+            with self.cond:
+                if not self.queue:
+                    self.cond.wait(0.5)
+                    continue
+                wait = self.queue[0][0] - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                _, _, line = self.queue.pop(0)
+            try:
+                self.ser.write(line)
+                self.stats["sent"] += 1
+                reply = self.ser.readline().strip()
+                if reply == b"ACK:" + line.split(b":", 1)[0]: self.stats["acked"] += 1
+            except (serial.SerialException, OSError):
+                self.stats["reconnects"] += 1
+                self._close()
+
+    def flush(self, timeout=2.0):
+        """Waits for every command due by now to be written; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.cond:
+                if not self.queue or self.queue[0][0] > time.monotonic(): return True
+            time.sleep(0.01)
+        return False
+
+    def close(self):
+        self.stop_event.set()
+        with self.cond: self.cond.notify()
+        if self.thread and self.thread.is_alive(): self.thread.join(timeout=2.0)
+        if self.ser is not None: self._close()
+
+def init_serial(port=None):
+    """Starts the LCD writer; the port opens and the board resets in the background."""
+    global lcd
+    if lcd is None: lcd = LcdWriter(port or SERIAL_PORT).start()
+    return True
+
+def send_lcd_command(command, data="", delay=0.0):
+    """Queues command in format COMMAND:DATA\n, optionally delay seconds from now"""
+    if lcd: lcd.send(command, data, delay)
+
+# ==================== FIRESTORE WRITE QUEUE ====================
+# Firestore sentinels are not JSON; journaled ops carry these markers instead
+SERVER_TIMESTAMP = {"$sentinel": "server_timestamp"}
+DELETE_FIELD = {"$sentinel": "delete"}
+
+def encode_fields(value):
+    if isinstance(value, dict): return {k: encode_fields(v) for k, v in value.items()}
+    if isinstance(value, datetime): return {"$datetime": value.isoformat()}
+    return value
+
+def decode_fields(value):
+    if isinstance(value, dict):
+        if value == SERVER_TIMESTAMP: return firestore.SERVER_TIMESTAMP
+        if value == DELETE_FIELD: return firestore.DELETE_FIELD
+        if set(value) == {"$datetime"}: return datetime.fromisoformat(value["$datetime"])
+        return {k: decode_fields(v) for k, v in value.items()}
+    return value
+
+def make_op(kind, collection, doc_id, data=None, merge=False):
+    """JSON-safe description of one Firestore write, as journaled and as passed to bulk_commit."""
+    op = {"kind": kind, "collection": collection, "doc": doc_id}
+    if data is not None: op["data"] = encode_fields(data)
+    if merge: op["merge"] = True
+    return op
+
+def apply_op(batch, client, op):
+    ref = client.collection(op["collection"]).document(op["doc"])
+    if op["kind"] == "set": batch.set(ref, decode_fields(op["data"]), merge=op.get("merge", False))
+    elif op["kind"] == "update": batch.update(ref, decode_fields(op["data"]))
+    else: batch.delete(ref)
+
+class WriteJournal:
+    """Durable SQLite queue of Firestore ops; a row is deleted only once its batch has committed."""
+    def __init__(self, path=WRITE_JOURNAL):
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS writes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, created REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0, error TEXT, dead INTEGER NOT NULL DEFAULT 0)""")
+        self.lock = threading.Lock()
+
+    def append(self, op):
+        with self.lock:
+            return self.conn.execute("INSERT INTO writes (op, created) VALUES (?, ?)", (json.dumps(op), time.time())).lastrowid
+
+    def pending(self, limit=FIRESTORE_BATCH_MAX):
+        """Oldest live ops as [(id, op)], in enqueue order."""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, op FROM writes WHERE dead = 0 ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(op)) for row_id, op in rows]
+
+    def ack(self, ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM writes WHERE id = ?", [(i,) for i in ids])
+
+    def fail(self, ids, error, dead=False):
+        with self.lock:
+            self.conn.executemany("UPDATE writes SET attempts = attempts + 1, error = ?, dead = ? WHERE id = ?",
+                                  [(error, int(dead), i) for i in ids])
+
+    def counts(self):
+        """(pending, dead)"""
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*) - COALESCE(SUM(dead), 0), COALESCE(SUM(dead), 0) FROM writes").fetchone()
+        return row[0], row[1]
+
+    def close(self):
+        with self.lock: self.conn.close()
+
+class FirestoreWriter:
+    """Journals Firestore writes and commits them from a background thread in batches.
+
+    Callers get control back as soon as the op is on disk. Ops are replayed after a restart and retried
+    with backoff while Firestore is unreachable; ops the server rejects outright are marked dead in the
+    journal instead of blocking the queue. Every op addresses a fixed document, so replays are idempotent.
+    """
+    @staticmethod
+    def permanent_errors():
+        return (google_exceptions.NotFound, google_exceptions.InvalidArgument,
+                google_exceptions.PermissionDenied, google_exceptions.FailedPrecondition)
+
+    def __init__(self, journal, client=None, batch_size=FIRESTORE_BATCH_MAX, flush_delay=FIRESTORE_FLUSH_DELAY, on_event=None):
+        self.journal = journal
+        self.client = client or (lambda: db)
+        self.batch_size = batch_size
+        self.flush_delay = flush_delay
+        self.on_event = on_event
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.idle = threading.Event()
+        self.thread = None
+        self.failures = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _emit(self, msg):
+        if self.on_event: self.on_event(msg)
+        else: print(msg)
+
+    def _enqueue(self, op):
+        self.idle.clear()
+        row_id = self.journal.append(op)
+        self.wake.set()
+        return row_id
+
+    def set(self, collection, doc_id, data, merge=False): return self._enqueue(make_op("set", collection, doc_id, data, merge))
+    def update(self, collection, doc_id, data): return self._enqueue(make_op("update", collection, doc_id, data))
+    def delete(self, collection, doc_id): return self._enqueue(make_op("delete", collection, doc_id))
+
+    def pending_docs(self, collection):
+        """doc_id -> fields written by queued ops (None after a delete), for reads that must see unsent writes.
+
+        A plain set replaces the fields; updates and merge sets are layered over the earlier queued ones.
+        """
+        docs = {}
+        for _, op in self.journal.pending(limit=-1):
+            if op["collection"] != collection: continue
+            if op["kind"] == "delete": docs[op["doc"]] = None
+            elif op["kind"] == "set" and not op.get("merge"): docs[op["doc"]] = op["data"]
+            else: docs[op["doc"]] = {**(docs.get(op["doc"]) or {}), **op["data"]}
+        return docs
+
+    def flush(self, timeout=None):
+        """Blocks until the journal has drained (dead ops aside); False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.wake.set()
+            if not self.idle.wait(None if deadline is None else max(0.0, deadline - time.monotonic())): return False
+            # idle can be stale: the worker may have found the journal empty just before an op was enqueued
+            if not self.journal.pending(1): return True
+            self.idle.clear()
+
+    def _commit(self, client, rows):
+        batch = client.batch()
+        for _, op in rows: apply_op(batch, client, op)
+        batch.commit()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            rows = self.journal.pending(self.batch_size)
+            client = self.client()
+            if not rows or client is None:
+                if not rows: self.idle.set()
+                self.wake.wait(None if not rows else FIRESTORE_RETRY_MAX)
+                self.wake.clear()
+                continue
+            if len(rows) < self.batch_size: self.stop_event.wait(self.flush_delay)  # Let a burst of scans share one batch
+            rows = self.journal.pending(self.batch_size)
+            try:
+                self._commit(client, rows)
+                self.journal.ack([row_id for row_id, _ in rows])
+                if self.failures: self._emit(f"Firestore sync resumed ({len(rows)} queued writes sent)")
+                self.failures = 0
+            except self.permanent_errors():
+                # One bad op fails the whole batch; commit the rest one by one and park the rejected ones
+                for i, (row_id, op) in enumerate(rows):
+                    try:
+                        self._commit(client, [(row_id, op)])
+                        self.journal.ack([row_id])
+                    except self.permanent_errors() as e:
+                        self.journal.fail([row_id], str(e), dead=True)
+                        self._emit(f"Firestore rejected {op['kind']} {op['collection']}/{op['doc']}: {e}")
+                    except Exception as e:
+                        self._back_off(rows[i:], e)
+                        break
+                else: self.failures = 0
+            except Exception as e:
+                self._back_off(rows, e)
+
+    def _back_off(self, rows, error):
+        """Records a transient failure of rows and waits before they are retried."""
+        self.failures += 1
+        self.journal.fail([row_id for row_id, _ in rows], str(error))
+        delay = min(FIRESTORE_RETRY_MAX, 2 ** (self.failures - 1))
+        if self.failures == 1: self._emit(f"Firestore unreachable, {len(rows)}+ writes queued locally: {error}")
+        self.stop_event.wait(delay)
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=2.0)
+
+def init_writer(on_event=None):
+    """Starts the Firestore writer; anything left in the journal from a previous run is replayed."""
+    global writer
+    if writer is None:
+        writer = FirestoreWriter(WriteJournal(), on_event=on_event).start()
+    else: writer.on_event = on_event
+    return writer
+
+# ==================== FIRESTORE HELPERS ====================
+def load_exam_roster(exam_id):
+    """ATTENDANCE documents of one exam keyed by matric, or None if Firestore is unavailable."""
+    if not db: return None
+    try:
+        roster = {}
+        for doc in db.collection('ATTENDANCE').where('exam_id', '==', exam_id).stream():
+            data = doc.to_dict()
+            roster[data.get('matric_no', doc.id[len(exam_id) + 1:])] = data
+        return roster
+    except: return None
 
 # --- UPDATED HELPER FOR UNDO SUPPORT ---
-def update_firebase_attendance(matric_no, exam_id):
+def update_firebase_attendance(matric_no, exam_id, roster=None):
     if not db: return None, None
+    if writer is None: raise RuntimeError("Firestore writer not started; attendance cannot be recorded")
     try:
         doc_id = f"{exam_id}_{matric_no}"
-        doc_ref = db.collection('ATTENDANCE').document(doc_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            data = doc.to_dict()
+        # Writes still in the journal win over the roster/server copy, so a quick second scan sees the first
+        pending = writer.pending_docs('ATTENDANCE').get(doc_id, {})
+        if pending is None: return None, None  # Deletion queued
+        if roster is not None:
+            data = roster.get(matric_no)  # Live roster cache, no round trip
+        elif pending and pending.get('status', 'Pending') != 'Pending':
+            return "ALREADY_MARKED", doc_id  # Marked earlier and not yet sent; no need to read the server copy
+        else:
+            doc = db.collection('ATTENDANCE').document(doc_id).get()
+            data = doc.to_dict() if doc.exists else None
+        if data is not None: data = {**data, **pending}
+        if data is not None:
             if data.get('status') == 'Pending':
-                doc_ref.update({'status': 'Present', 'timestamp': firestore.SERVER_TIMESTAMP})
+                writer.update('ATTENDANCE', doc_id, {'status': 'Present', 'timestamp': SERVER_TIMESTAMP})
+                if roster is not None: roster.set_status(matric_no, 'Present')
                 # Return Table No AND Doc ID for undo tracking
                 return data.get('table_no', 'N/A'), doc_id
             else: return "ALREADY_MARKED", doc_id
@@ -123,213 +513,815 @@ def update_firebase_attendance(matric_no, exam_id):
     except: return None, None
 
 # --- UPDATED HELPER FOR UNDO SUPPORT ---
-def update_bathroom_log(attendance_id):
+def update_bathroom_log(attendance_id, bathroom=None):
+    if bathroom is not None: return bathroom.toggle(attendance_id)  # Decided locally, written async
     if not db: return None, None
     try:
         # Check if they are currently OUT
-        query = db.collection('BATHROOM_LOG').where('attendance_id', '==', attendance_id).where('status', '==', 'OUT').limit(1)
-        docs = list(query.stream())
+        query = db.collection('BATHROOM_LOG').where('attendance_id', '==', attendance_id).where('status', '==', 'OUT')
+        out = {doc.id: doc.to_dict() for doc in query.stream()}
+        # Overlay writes still in the journal so a quick second scan sees the first
+        for doc_id, data in writer.pending_docs('BATHROOM_LOG').items():
+            if data is None: out.pop(doc_id, None)
+            elif data.get('attendance_id') == attendance_id and data.get('status') == 'OUT': out[doc_id] = data
         
-        if docs:
+        if out:
             # Student is returning (Delete the OUT record)
-            doc = docs[0]
-            backup_data = doc.to_dict() # Backup data before delete
-            doc.reference.delete()
-            return "RETURNED", backup_data # Return backup data to restore if undone
+            doc_id, backup_data = next(iter(out.items())) # Backup data before delete
+            writer.delete('BATHROOM_LOG', doc_id)
+            return "RETURNED", {'doc_id': doc_id, 'data': backup_data} # Return backup data to restore if undone
         else:
-            # Student is leaving (Create OUT record)
-            _, new_ref = db.collection('BATHROOM_LOG').add({
+            # Student is leaving (Create OUT record); the id is minted locally so replays stay idempotent
+            doc_id = uuid.uuid4().hex[:20]
+            writer.set('BATHROOM_LOG', doc_id, {
                 'attendance_id': attendance_id,
-                'exit_time': firestore.SERVER_TIMESTAMP,
+                'exit_time': SERVER_TIMESTAMP,
                 'status': 'OUT'
             })
-            return "OUT", new_ref.id # Return new ID to delete if undone
+            return "OUT", doc_id # Return new ID to delete if undone
     except: return None, None
 
+def student_doc(matric, name, faculty, program):
+    return {'name': name, 'matric_no': matric, 'faculty': faculty, 'program': program.split()[0] if program else ''}
+
+# ==================== BULK FIRESTORE OPS ====================
+def bulk_commit(ops, chunk_size=FIRESTORE_BATCH_MAX, workers=4, progress=None, client=None, retries=3):
+    """Commits make_op() writes in WriteBatches of chunk_size with several batches in flight.
+
+    Each batch is atomic and retried with backoff on transient errors. progress(done, total) is called
+    as batches land. Returns (written, errors) with errors as [(first doc id of the batch, message)].
+    """
+    client = client or db
+    chunks = [ops[i:i + chunk_size] for i in range(0, len(ops), chunk_size)]
+    lock = threading.Lock()
+    done = [0]
+
+    def commit(chunk):
+        for attempt in range(retries + 1):
+            try:
+                batch = client.batch()
+                for op in chunk: apply_op(batch, client, op)
+                batch.commit()
+                break
+            except FirestoreWriter.permanent_errors(): raise
+            except Exception:
+                if attempt == retries: raise
+                time.sleep(0.5 * 2 ** attempt)
+        with lock:
+            done[0] += len(chunk)
+            if progress: progress(done[0], len(ops))
+        return len(chunk)
+
+    written, errors = 0, []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(commit, chunk): chunk for chunk in chunks}
+        for future, chunk in futures.items():
+            try: written += future.result()
+            except Exception as e: errors.append((chunk[0]["doc"], str(e)))
+    return written, errors
+
+def finalize_exam(exam_id, progress=None):
+    """Marks every ATTENDANCE entry of exam_id still Pending as Absent. Returns bulk_commit's result."""
+    if writer: writer.flush(timeout=30)  # Present marks still queued must land first
+    query = db.collection('ATTENDANCE').where('exam_id', '==', exam_id).where('status', '==', 'Pending')
+    ops = [make_op("update", 'ATTENDANCE', doc.id, {'status': 'Absent', 'finalized_at': SERVER_TIMESTAMP})
+           for doc in query.stream()]
+    return bulk_commit(ops, progress=progress)
+
+def sync_students(progress=None):
+    """Upserts a STUDENT document for every student in the local enrolment store."""
+    ops = [make_op("set", 'STUDENT', matric, student_doc(matric, info['name'], info.get('faculty', ''), info.get('program', '')), merge=True)
+           for matric, info in store.students().items()]
+    return bulk_commit(ops, progress=progress)
+
+def import_roster(exam_id, csv_path, progress=None):
+    """Creates ATTENDANCE entries from a CSV of matric_no,table_no (header optional).
+
+    Students already on the roster only get their table updated, so re-importing never resets a status.
+    If the current roster cannot be read nothing is written and the failure is the only error returned.
+    """
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        rows = [r for r in csv.reader(f) if r and r[0].strip()]
+    if rows and rows[0][0].strip().lower() in ('matric', 'matric_no'): rows = rows[1:]
+    existing = load_exam_roster(exam_id)
+    if existing is None: return 0, [(exam_id, "could not read the existing roster; import aborted")]
+    ops = []
+    for row in rows:
+        matric = row[0].strip()
+        table = row[1].strip() if len(row) > 1 else 'N/A'
+        data = {'exam_id': exam_id, 'matric_no': matric, 'table_no': table}
+        if matric not in existing: data['status'] = 'Pending'
+        ops.append(make_op("set", 'ATTENDANCE', f"{exam_id}_{matric}", data, merge=True))
+    return bulk_commit(ops, progress=progress)
+
+# ==================== COORDINATE MAPPING ====================
+def jpeg_size(data):
+    """(width, height) from a JPEG's SOF header, without decoding it; None if not found."""
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF: return None
+        marker = data[i + 1]
+        if marker == 0xFF: i += 1; continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7: i += 2; continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        i += 2 + length
+    return None
+
+def map_bbox(bbox, src_size, dst_size):
+    """Rescales an (x, y, w, h) box from a src_size (w, h) frame to the same field of view at dst_size.
+
+    Preview and capture frames come from the same sensor window, so mirrored boxes map the same way.
+    """
+    sx, sy = dst_size[0] / src_size[0], dst_size[1] / src_size[1]
+    x, y, w, h = bbox
+    return int(x * sx), int(y * sy), int(round(w * sx)), int(round(h * sy))
+
+# ==================== CAPTURE DECODE ====================
+REDUCED_DECODE_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                        4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def decode_capture(data, bbox, mirrored=True, reduce=None, source_size=None):
+    """Red/IR channel of bbox from a capture JPEG, without building the full flipped BGR frame.
+
+    bbox is in mirrored coordinates, either of the capture itself or of a source_size (w, h) preview
+    frame, in which case it is rescaled to the capture resolution first. With reduce on, libjpeg
+    decodes at 1/2, 1/4 or 1/8 scale as long as the hand stays at least ROI_SIZE px on its short side.
+    Returns (crop, factor) where factor is the decode downscale.
+    """
+    reduce = REDUCED_DECODE if reduce is None else reduce
+    if source_size is not None:
+        size = jpeg_size(data)
+        if size is None: raise ValueError("Capture is not a decodable JPEG")
+        bbox = map_bbox(bbox, source_size, size)
+    x, y, w, h = bbox
+    factor = 1
+    if reduce:
+        factor = next((f for f in (8, 4, 2) if min(w, h) // f >= ROI_SIZE), 1)
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_DECODE_FLAGS[factor])
+    if img is None: raise ValueError("Capture is not a decodable JPEG")
+
+    H, W = img.shape[:2]
+    x, y, w, h = x // factor, y // factor, w // factor, h // factor
+    x1, x2 = max(0, x), min(W, x + w)
+    y1, y2 = max(0, y), min(H, y + h)
+    if mirrored: x1, x2 = W - x2, W - x1  # Same window in the unflipped frame
+    if x2 <= x1 or y2 <= y1: return None, factor
+    crop = cv2.extractChannel(img[y1:y2, x1:x2], 2)
+    return (cv2.flip(crop, 1) if mirrored else crop), factor
+
+# ==================== CAPTURE CLIENT ====================
+class CaptureClient:
+    """Keep-alive client for the ESP32 /capture endpoint with retry/backoff and a speculative prefetch."""
+    def __init__(self, url=None, size=None, timeout=8, retries=2, backoff=0.2):
+        self.url = url or CAPTURE_URL
+        self.size = size or CAPTURE_SIZE
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(500, 502, 503, 504), allowed_methods=["GET"])
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=retry))
+        self.lock = threading.Lock()
+        self.pending = None   # (started_at, Future) of the in-flight prefetch
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    def fetch(self):
+        resp = self.session.get(self.url, params={"size": self.size}, timeout=self.timeout)
+        if resp.status_code != 200: raise Exception(f"Cam Error: {resp.status_code}")
+        return resp.content
+
+    def prefetch(self):
+        """Starts an HD capture in the background unless one is already in flight."""
+        with self.lock:
+            if self.pending and not self.pending[1].done(): return
+            self.pending = (time.time(), self.pool.submit(self.fetch))
+
+    def discard(self):
+        with self.lock: self.pending = None
+
+    def get(self, max_age=PREFETCH_MAX_AGE):
+        """JPEG bytes, reusing a prefetch started at most max_age seconds ago."""
+        with self.lock: pending, self.pending = self.pending, None
+        if pending and time.time() - pending[0] <= max_age:
+            try: return pending[1].result(timeout=self.timeout)
+            except Exception: pass  # Fall back to a fresh capture
+        return self.fetch()
+
+    def close(self):
+        self.discard()
+        self.pool.shutdown(wait=False)
+        self.session.close()
+
 # ==================== THREADED CAMERA CLASS ====================
 class ThreadedCamera:
-    def __init__(self, src, downsample_scale=0.5):
-        self.capture = cv2.VideoCapture(src)
-        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    """Reads the MJPEG stream into a preallocated ring of frame buffers.
+
+    Consumers get a read-only view of the newest completed frame plus its sequence number. The slot a
+    consumer last received is pinned and never overwritten until that consumer asks again; if the consumers
+    pin every other slot, the ring grows by one buffer instead.
+    The reader thread also supervises the stream: if no frame arrives within STREAM_STALL_TIMEOUT it
+    reconnects with exponential backoff, alternating between the given source URLs.
+    """
+    def __init__(self, src, downsample_scale=0.5, ring_size=4, on_event=None):
+        self.sources = list(src) if isinstance(src, (list, tuple)) else [src]
+        self.capture = None
         self.downsample_scale = downsample_scale
+        self.ring_size = ring_size
+        self.on_event = on_event   # Called with a message on connect/stall/failover
         self.lock = threading.Lock()
-        self.frame = None
+        self.stop_event = threading.Event()
+        self.ring = None       # ring_size (h, w, 3) uint8 buffers, allocated on the first frame
+        self.raw = None        # Full-size decode buffer when downsampling
+        self.latest = -1       # Slot of the newest completed frame
+        self.seq = 0           # Frames completed so far
+        self.slot_seq = [0] * ring_size
+        self.pins = {}         # Consumer -> slot it is currently reading
+        self.last_seen = {}    # Consumer -> seq it last received
         self.status = False
         self.is_running = False
         self.thread = None
 
+        # --- Supervisor state & counters ---
+        self.source_index = 0
+        self.attempt = 0
+        self.last_frame_time = 0.0
+        self.frame_times = deque(maxlen=30)
+        self.read_ms = deque(maxlen=30)
+        self.drops = 0
+        self.reconnects = 0
+
     def start(self):
         if self.is_running: return
         self.is_running = True
+        self.stop_event.clear()
         self.thread = threading.Thread(target=self.update, daemon=True)
         self.thread.start()
 
+    def _event(self, msg):
+        if self.on_event: self.on_event(msg)
+
+    def _connect(self):
+        if self.capture is not None: self.capture.release()
+        src = self.sources[self.source_index]
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(STREAM_STALL_TIMEOUT * 1000),
+                  cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(STREAM_STALL_TIMEOUT * 1000)]
+        self.capture = cv2.VideoCapture(src, cv2.CAP_ANY, params)
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.last_frame_time = time.time()  # Start the stall deadline now
+        if self.capture.isOpened(): self._event(f"Stream connected: {src}")
+
+    def _reconnect(self, reason):
+        delay = min(STREAM_BACKOFF_MAX, STREAM_BACKOFF_BASE * (2 ** self.attempt))
+        self.attempt += 1
+        self.reconnects += 1
+        self.source_index = (self.source_index + 1) % len(self.sources)
+        self._event(f"Stream {reason}, retrying {self.sources[self.source_index]} in {delay:.1f}s")
+        with self.lock: self.status = False
+        if self.stop_event.wait(delay): return
+        self._connect()
+
+    def _free_slot(self):
+        busy = set(self.pins.values()) | {self.latest}
+        slot = next((i for i in range(self.ring_size) if i not in busy), None)
+        if slot is None:
+            # More consumers than spare slots: add a buffer rather than overwrite a frame still being read
+            self.ring.append(np.empty_like(self.ring[0]))
+            self.slot_seq.append(0)
+            slot = self.ring_size
+            self.ring_size += 1
+        return slot
+
+    def _ensure_ring(self, shape):
+        if self.ring is None or self.ring[0].shape != shape:
+            with self.lock:
+                self.ring = [np.empty(shape, dtype=np.uint8) for _ in range(self.ring_size)]
+                self.latest, self.pins = -1, {}
+
     def update(self):
+        self._connect()
         while self.is_running:
-            if self.capture.isOpened():
-                status, frame = self.capture.read()
+            if not self.capture.isOpened():
+                self._reconnect("unavailable")
+                continue
+            if time.time() - self.last_frame_time > STREAM_STALL_TIMEOUT:
+                self._reconnect("stalled")
+                continue
+
+            with self.lock: slot = self._free_slot() if self.ring is not None else None
+            t0 = time.perf_counter()
+            if self.downsample_scale < 1.0:
+                status, frame = self.capture.read(self.raw)
                 if status:
-                    if self.downsample_scale < 1.0:
-                        h, w = frame.shape[:2]
-                        frame = cv2.resize(frame, (int(w * self.downsample_scale), int(h * self.downsample_scale)))
-                    with self.lock:
-                        self.frame = frame
-                        self.status = status
-                else:
-                    time.sleep(0.1)
+                    self.raw = frame
+                    h, w = frame.shape[:2]
+                    size = (int(w * self.downsample_scale), int(h * self.downsample_scale))
+                    self._ensure_ring((size[1], size[0], 3))
+                    if slot is None: slot = 0
+                    cv2.resize(frame, size, dst=self.ring[slot])
             else:
-                time.sleep(0.1)
+                status, frame = self.capture.read(self.ring[slot] if slot is not None else None)
+                if status:
+                    self._ensure_ring(frame.shape)
+                    if slot is None: slot = 0
+                    if frame is not self.ring[slot] and not np.shares_memory(frame, self.ring[slot]):
+                        self.ring[slot][...] = frame
+
+            if status:
+                now = time.time()
+                self.read_ms.append((time.perf_counter() - t0) * 1000)
+                self.frame_times.append(now)
+                self.last_frame_time = now
+                self.attempt = 0
+                with self.lock:
+                    self.seq += 1
+                    self.slot_seq[slot] = self.seq
+                    self.latest = slot
+                    self.status = status
+            else:
+                self.drops += 1
+                self.stop_event.wait(0.05)
 
-    def get_frame(self):
+    def get_frame(self, consumer="gui"):
+        """(status, frame, seq, is_new); frame stays valid until this consumer's next call."""
         with self.lock:
-            if self.frame is not None:
-                return self.status, self.frame.copy()
-            return False, None
+            if self.latest < 0: return False, None, 0, False
+            slot = self.latest
+            self.pins[consumer] = slot
+            seq = self.slot_seq[slot]
+            is_new = seq != self.last_seen.get(consumer)
+            self.last_seen[consumer] = seq
+            view = self.ring[slot].view()
+        view.flags.writeable = False
+        return self.status, view, seq, is_new
+
+    def release(self, consumer="gui"):
+        with self.lock: self.pins.pop(consumer, None)
+
+    def stats(self):
+        times = list(self.frame_times)
+        fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+        return {"fps": fps, "read_ms": float(np.mean(self.read_ms)) if self.read_ms else 0.0,
+                "frame_age": time.time() - self.last_frame_time if self.last_frame_time else None,
+                "drops": self.drops, "reconnects": self.reconnects, "source": self.sources[self.source_index]}
 
     def stop(self):
         self.is_running = False
+        self.stop_event.set()
         if self.thread and self.thread.is_alive():
             self.thread.join(timeout=1.0)
-        if self.capture.isOpened():
+        if self.capture is not None and self.capture.isOpened():
             self.capture.release()
 
 # ==================== HAND TRACKER ====================
-class HandTracker:
-    def __init__(self):
-        self.model_path = 'hand_landmarker.task'
-        model_url = 'https://storage.googleapis.com/mediapipe-models/hand_landmarker/hand_landmarker/float16/1/hand_landmarker.task'
-        if not os.path.exists(self.model_path):
-            urllib.request.urlretrieve(model_url, self.model_path)
+_model_lock = threading.Lock()
+
+def ensure_hand_model(model_path='hand_landmarker.task'):
+    """Downloads the landmarker model once; concurrent trackers wait rather than load a partial file."""
+    model_url = 'https://storage.googleapis.com/mediapipe-models/hand_landmarker/hand_landmarker/float16/1/hand_landmarker.task'
+    with _model_lock:
+        if not os.path.exists(model_path):
+            tmp = f"{model_path}.{os.getpid()}.part"
+            try:
+                urllib.request.urlretrieve(model_url, tmp)
+                os.replace(tmp, model_path)
+            finally:
+                if os.path.exists(tmp): os.remove(tmp)
+    return model_path
+
+def hand_landmarker_options(running_mode):
+    model_path = ensure_hand_model()
+
+    BaseOptions = mp.tasks.BaseOptions
+    HandLandmarkerOptions = mp.tasks.vision.HandLandmarkerOptions
+    return HandLandmarkerOptions(
+        base_options=BaseOptions(model_asset_path=model_path),
+        running_mode=running_mode,
+        num_hands=1,
+        min_hand_detection_confidence=0.5,
+        min_hand_presence_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
 
-        BaseOptions = mp.tasks.BaseOptions
+class HandTracker:
+    def __init__(self, adaptive=None):
         HandLandmarker = mp.tasks.vision.HandLandmarker
-        HandLandmarkerOptions = mp.tasks.vision.HandLandmarkerOptions
-        VisionRunningMode = mp.tasks.vision.RunningMode
-
-        options = HandLandmarkerOptions(
-            base_options=BaseOptions(model_asset_path=self.model_path),
-            running_mode=VisionRunningMode.VIDEO,
-            num_hands=1,
-            min_hand_detection_confidence=0.5,
-            min_hand_presence_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+        options = hand_landmarker_options(mp.tasks.vision.RunningMode.VIDEO)
         self.detector = HandLandmarker.create_from_options(options)
+        self.adaptive = ADAPTIVE_TRACKING if adaptive is None else adaptive
+        # Crops get their own VIDEO-mode graph so its tracking state never mixes crop and full-frame coordinates
+        self.crop_detector = HandLandmarker.create_from_options(options) if self.adaptive else None
         self.frames_stable = 0
         self.last_bbox = None
+        self.last_result = (False, 0, None)
+        self.frame_count = 0
+        self.history = deque(maxlen=STABLE_WINDOW)  # (frame_count, extent, palm centre, palm length)
+        self.last_motion = None                     # (iou, speed, scale change) of the last tracked frame
+        self.counts = {"full": 0, "crop": 0, "skipped": 0}
         self.start_time = time.time()
+        self.last_timestamp = -1
+        self.lock = threading.RLock()  # Held by TrackingWorker across process() and the is_ready() reads
 
     def process(self, frame):
+        """Preview frames only: VIDEO-mode state assumes one stream at one resolution."""
+        with self.lock: return self._process(frame, self.adaptive)
+
+    def _detect(self, detector, frame, ox=0, oy=0):
+        """(21, 3) landmark pixels in full-frame coordinates for frame placed at (ox, oy), or None."""
         h, w = frame.shape[:2]
         frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame_rgb)
-        timestamp_ms = int((time.time() - self.start_time) * 1000)
-        
-        detection_result = self.detector.detect_for_video(mp_image, timestamp_ms)
-        
-        if detection_result.hand_landmarks:
-            hand_landmarks = detection_result.hand_landmarks[0]
-            x_min, y_min = w, h
-            x_max, y_max = 0, 0
-            for lm in hand_landmarks:
-                x, y = int(lm.x * w), int(lm.y * h)
-                x_min = min(x_min, x)
-                x_max = max(x_max, x)
-                y_min = min(y_min, y)
-                y_max = max(y_max, y)
+        # VIDEO mode rejects repeated timestamps; keep them strictly increasing across both graphs
+        timestamp_ms = max(int((time.time() - self.start_time) * 1000), self.last_timestamp + 1)
+        self.last_timestamp = timestamp_ms
+        
+        detection_result = detector.detect_for_video(mp_image, timestamp_ms)
+        if not detection_result.hand_landmarks: return None
+        points = np.array([(lm.x, lm.y, lm.z) for lm in detection_result.hand_landmarks[0]], dtype=np.float32)
+        points *= (w, h, w)
+        points[:, 0] += ox
+        points[:, 1] += oy
+        return points
+
+    def _crop_window(self, w, h):
+        x, y, bw, bh = self.last_bbox
+        m = int(max(bw, bh) * TRACK_CROP_MARGIN)
+        return max(0, x - m), max(0, y - m), min(w, x + bw + m), min(h, y + bh + m)
+
+    def _motion(self, extent, palm, scale):
+        """(iou, speed, scale change) of this frame against the history window."""
+        first_frame, _, first_palm, first_scale = self.history[0]
+        prev = self.history[-1][1]
+        ix = max(0.0, min(extent[2], prev[2]) - max(extent[0], prev[0]))
+        iy = max(0.0, min(extent[3], prev[3]) - max(extent[1], prev[1]))
+        inter = ix * iy
+        union = (extent[2] - extent[0]) * (extent[3] - extent[1]) + (prev[2] - prev[0]) * (prev[3] - prev[1]) - inter
+        iou = inter / union if union > 0 else 0.0
+        speed = float(np.hypot(*(palm - first_palm))) / max(1, self.frame_count - first_frame) / scale
+        return iou, speed, abs(scale / first_scale - 1)
+
+    def _process(self, frame, adaptive):
+        h, w = frame.shape[:2]
+        self.frame_count += 1
+        # A still hand keeps its last result on skipped frames; stability keeps counting so is_ready()
+        # fires on the same frame, but the frame that crosses the threshold is always re-detected.
+        if adaptive and self.frames_stable > 0 and self.frames_stable != 5 and self.frame_count % TRACK_STABLE_STRIDE:
+            self.frames_stable += 1
+            self.counts["skipped"] += 1
+            return self.last_result
+
+        points = None
+        if adaptive and self.last_bbox:
+            x0, y0, x1, y1 = self._crop_window(w, h)
+            if x1 - x0 > 32 and y1 - y0 > 32:
+                points = self._detect(self.crop_detector, frame[y0:y1, x0:x1], x0, y0)
+                if points is not None: self.counts["crop"] += 1
+        if points is None:  # Tracking lost (or not adaptive): full-frame detection
+            points = self._detect(self.detector, frame)
+            self.counts["full"] += 1
+        
+        if points is not None:
+            extent = np.concatenate([points[:, :2].min(axis=0), points[:, :2].max(axis=0)])
+            x_min, y_min, x_max, y_max = extent.astype(int)
             
             pad = 40
             x_min, y_min = max(0, x_min - pad), max(0, y_min - pad)
             x_max, y_max = min(w, x_max + pad), min(h, y_max + pad)
             box = (x_min, y_min, x_max - x_min, y_max - y_min)
             
-            palm_x, palm_y = hand_landmarks[9].x * w, hand_landmarks[9].y * h
-            dist = np.sqrt((palm_x - w//2)**2 + (palm_y - h//2)**2)
+            palm = points[9, :2]
+            scale = max(1.0, float(np.hypot(*(palm - points[0, :2]))))  # Wrist to middle-finger MCP
+            dist = np.sqrt((palm[0] - w//2)**2 + (palm[1] - h//2)**2)
             score = max(0, 100 - int(dist * 0.3))
             
-            if self.last_bbox:
-                if abs(self.last_bbox[0] - box[0]) < 20: 
+            if self.history:
+                self.last_motion = iou, speed, scale_change = self._motion(extent, palm, scale)
+                if iou >= STABLE_MIN_IOU and speed <= STABLE_MAX_SPEED and scale_change <= STABLE_MAX_SCALE:
                     self.frames_stable += 1
                     score += 20
                 else: self.frames_stable = 0
             
+            self.history.append((self.frame_count, extent, palm, scale))
             self.last_bbox = box
-            return True, min(100, score), box
+            self.last_result = (True, min(100, score), box)
+            return self.last_result
         
         self.frames_stable = 0
-        return False, 0, None
+        self.last_bbox = None
+        self.history.clear()
+        self.last_result = (False, 0, None)
+        return self.last_result
 
     def is_ready(self): return self.frames_stable > 5
+    def is_settling(self): return self.frames_stable >= PREFETCH_STABLE_FRAMES
+    def reset(self):
+        with self.lock:
+            self.frames_stable = 0
+            self.history.clear()
+    def close(self):
+        self.detector.close()
+        if self.crop_detector: self.crop_detector.close()
+
+class HandDetector:
+    """IMAGE-mode landmarker for one-off HD frames; independent of the preview tracker's VIDEO state."""
+    def __init__(self):
+        HandLandmarker = mp.tasks.vision.HandLandmarker
+        self.detector = HandLandmarker.create_from_options(hand_landmarker_options(mp.tasks.vision.RunningMode.IMAGE))
+        self.lock = threading.Lock()  # A landmarker instance is not re-entrant
+
+    def detect(self, frame, pad=40):
+        """(found, box) for the most prominent hand in a BGR frame."""
+        h, w = frame.shape[:2]
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        with self.lock: result = self.detector.detect(mp_image)
+        if not result.hand_landmarks: return False, None
+        points = np.array([(lm.x, lm.y) for lm in result.hand_landmarks[0]], dtype=np.float32) * (w, h)
+        x_min, y_min = np.maximum(points.min(axis=0).astype(int) - pad, 0)
+        x_max, y_max = np.minimum(points.max(axis=0).astype(int) + pad, (w, h))
+        return True, (int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min))
+
     def close(self): self.detector.close()
 
+# ==================== TRACKING WORKER ====================
+class TrackingWorker:
+    """Runs HandTracker on the newest preview frame off the Tk thread; stale frames are skipped, never queued."""
+    def __init__(self, camera, tracker, enabled=None):
+        self.camera = camera
+        self.tracker = tracker
+        self.enabled = enabled or (lambda: True)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.result = None        # Latest published result dict
+        self.result_id = 0
+        self.last_seq = None
+        self.skipped = 0          # Camera frames that arrived while inference was busy
+        self.frame_times = deque(maxlen=30)
+        self.infer_ms = deque(maxlen=30)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            if not self.enabled():
+                self.camera.release("tracker")
+                self.stop_event.wait(0.02)
+                continue
+            status, frame, seq, is_new = self.camera.get_frame(consumer="tracker")
+            if not status or not is_new:
+                self.stop_event.wait(0.005)
+                continue
+            if self.last_seq is not None and seq > self.last_seq + 1: self.skipped += seq - self.last_seq - 1
+            self.last_seq = seq
+            mirrored = cv2.flip(frame, 1)
+            self.camera.release("tracker")
+            t0 = time.perf_counter()
+            with self.tracker.lock:
+                found, quality, box = self.tracker.process(mirrored)
+                ready, settling = self.tracker.is_ready(), self.tracker.is_settling()
+            now = time.perf_counter()
+            self.infer_ms.append((now - t0) * 1000)
+            self.frame_times.append(now)
+            with self.lock:
+                self.result_id += 1
+                self.result = {"seq": seq, "found": found, "quality": quality, "box": box,
+                               "size": (mirrored.shape[1], mirrored.shape[0]),
+                               "ready": ready, "settling": settling, "time": time.time()}
+
+    def latest(self):
+        """(result, result_id); result is None until the first inference completes."""
+        with self.lock: return self.result, self.result_id
+
+    def stats(self):
+        times = list(self.frame_times)
+        fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+        return {"fps": fps, "infer_ms": float(np.mean(self.infer_ms)) if self.infer_ms else 0.0, "skipped": self.skipped}
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+        self.camera.release("tracker")
+
+# ==================== STAGE PROFILER ====================
+class StageLap:
+    """Timings of one extraction run, committed to the profiler as a unit."""
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.start = self.last = time.perf_counter()
+        self.stages = []   # (stage, ms, output_bytes, output_shape)
+
+    def mark(self, stage, output=None):
+        now = time.perf_counter()
+        nbytes = getattr(output, "nbytes", 0)
+        shape = getattr(output, "shape", None)
+        self.stages.append((stage, (now - self.last) * 1000, nbytes, shape))
+        self.last = now
+
+    def done(self):
+        self.stages.append(("total", (time.perf_counter() - self.start) * 1000, 0, None))
+        self.profiler.commit(self.stages)
+
+class StageProfiler:
+    """Rolling per-stage wall times with p50/p95/p99, exportable as JSON or Prometheus text."""
+    def __init__(self, window=200):
+        self.window = window
+        self.lock = threading.Lock()
+        self.times = {}    # Stage -> deque of recent ms
+        self.totals = {}   # Stage -> [count, sum_ms] since start
+        self.outputs = {}  # Stage -> (bytes, shape) of the last output
+
+    def lap(self): return StageLap(self)
+
+    def commit(self, stages):
+        with self.lock:
+            for stage, ms, nbytes, shape in stages:
+                self.times.setdefault(stage, deque(maxlen=self.window)).append(ms)
+                total = self.totals.setdefault(stage, [0, 0.0])
+                total[0] += 1; total[1] += ms
+                if shape is not None: self.outputs[stage] = (nbytes, shape)
+
+    def snapshot(self):
+        with self.lock:
+            snap = {}
+            for stage, times in self.times.items():
+                p50, p95, p99 = np.percentile(np.fromiter(times, dtype=np.float64), [50, 95, 99])
+                nbytes, shape = self.outputs.get(stage, (0, None))
+                snap[stage] = {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+                               "count": self.totals[stage][0], "sum_ms": round(self.totals[stage][1], 3),
+                               "output_bytes": nbytes, "output_shape": list(shape) if shape else None}
+            return snap
+
+    def to_json(self): return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        lines = ["# HELP palmpass_stage_ms Vein extraction stage wall time in milliseconds",
+                 "# TYPE palmpass_stage_ms summary"]
+        snap = self.snapshot()
+        for stage, s in snap.items():
+            for q, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'palmpass_stage_ms{{stage="{stage}",quantile="{q}"}} {s[key]}')
+            lines.append(f'palmpass_stage_ms_sum{{stage="{stage}"}} {s["sum_ms"]}')
+            lines.append(f'palmpass_stage_ms_count{{stage="{stage}"}} {s["count"]}')
+        lines += ["# HELP palmpass_stage_output_bytes Size of the last output of each stage",
+                  "# TYPE palmpass_stage_output_bytes gauge"]
+        for stage, s in snap.items():
+            if s["output_shape"]: lines.append(f'palmpass_stage_output_bytes{{stage="{stage}"}} {s["output_bytes"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Writes JSON or Prometheus text depending on the file suffix (.json / .prom)."""
+        path = Path(path)
+        text = self.to_json() if path.suffix == ".json" else self.to_prometheus()
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(text)
+        os.replace(tmp, path)  # Scrapers never see a half-written file
+
+    def status_text(self):
+        snap = self.snapshot()
+        if "total" not in snap: return ""
+        slowest = max((s for s in snap if s != "total"), key=lambda s: snap[s]["p50_ms"])
+        return (f"Extract p50 {snap['total']['p50_ms']:.0f}ms p95 {snap['total']['p95_ms']:.0f}ms | "
+                f"{slowest} {snap[slowest]['p50_ms']:.0f}ms")
+
 # ==================== VEIN FEATURE EXTRACTOR ====================
+def grid_densities(skel, grid_size):
+    """Mean pixel value of each grid_size block (edge blocks may be smaller), via two segment sums."""
+    h, w = skel.shape
+    ys, xs = np.arange(0, h, grid_size), np.arange(0, w, grid_size)
+    sums = np.add.reduceat(np.add.reduceat(skel, ys, axis=0, dtype=np.uint64), xs, axis=1, dtype=np.uint64)
+    sizes = np.outer(np.diff(np.r_[ys, h]), np.diff(np.r_[xs, w]))
+    return sums / sizes
+
 class VeinFeatureExtractor:
-    def __init__(self):
+    def __init__(self, grid_sizes=VECTOR_GRIDS, fast_roi=None):
         if not HAS_SKIMAGE:
             raise ImportError("scikit-image is required.")
+        self.grid_sizes = tuple(grid_sizes)  # Several sizes give a multi-scale density descriptor
+        self.fast_roi = FAST_ROI if fast_roi is None else fast_roi
         
         self.clahe_standard = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
         self.clahe_strong = cv2.createCLAHE(clipLimit=4.0, tileGridSize=(8,8))
+        self.failed_stage = None  # Stage name of the last failed extraction
+        self.profiler = None      # Optional StageProfiler fed on every extraction
 
     def extract_features(self, img, bbox=None):
+        self.failed_stage = None
+        stage = "crop"
+        lap = self.profiler.lap() if self.profiler else None
         try:
             if bbox is not None:
                 x, y, w, h = bbox
                 img = img[max(0, y):min(img.shape[0], y+h), max(0, x):min(img.shape[1], x+w)]
+            if lap: lap.mark("crop", img)
 
-            if img is None or img.size == 0: return None, None
+            if img is None or img.size == 0:
+                self.failed_stage = stage
+                return None, None
 
             # 1. Grayscale
             if len(img.shape) == 3: gray = img[:, :, 2] 
             else: gray = img
 
-            # 2. Denoise
-            denoised = cv2.bilateralFilter(gray, 9, 80, 80)
-
-            # 3. ROI & Rotation
-            roi = self._get_rotated_roi(denoised)
-            if roi is None: return None, None
-            roi = cv2.resize(roi, (400, 400))
+            if self.fast_roi:
+                # 2-3. ROI & Rotation warped straight from the crop, then denoise the ROI_SIZE ROI only
+                stage = "roi"
+                roi, hand_mask = self._warp_roi_fast(gray)
+                if roi is None:
+                    self.failed_stage = stage
+                    return None, None
+                if lap: lap.mark("fast_roi", roi)
+                stage = "denoise"
+                denoised = cv2.bilateralFilter(roi, FAST_ROI_BILATERAL_D, 80, 80)
+                roi = cv2.bitwise_and(denoised, denoised, mask=hand_mask)
+                if lap: lap.mark("bilateral", roi)
+            else:
+                # 2. Denoise
+                stage = "denoise"
+                denoised = cv2.bilateralFilter(gray, 9, 80, 80)
+                if lap: lap.mark("bilateral", denoised)
+
+                # 3. ROI & Rotation
+                stage = "roi"
+                roi = self._get_rotated_roi(denoised)
+                if roi is None:
+                    self.failed_stage = stage
+                    return None, None
+                if lap: lap.mark("rotated_roi", roi)
+                roi = cv2.resize(roi, (ROI_SIZE, ROI_SIZE))
+                if lap: lap.mark("resize", roi)
 
             # 4. Equalize
+            stage = "enhance"
             equalized = cv2.equalizeHist(roi)
+            if lap: lap.mark("equalize", equalized)
             
             # 5. CLAHE
             enhanced = self.clahe_standard.apply(equalized)
+            if lap: lap.mark("clahe", enhanced)
 
             # 6. Blackhat
             kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (25, 25))
             blackhat = cv2.morphologyEx(enhanced, cv2.MORPH_BLACKHAT, kernel)
+            if lap: lap.mark("blackhat", blackhat)
             blackhat_boosted = self.clahe_strong.apply(blackhat)
             blackhat_norm = cv2.normalize(blackhat_boosted, None, 0, 255, cv2.NORM_MINMAX)
+            if lap: lap.mark("clahe_strong", blackhat_norm)
 
             # 7. Adaptive Threshold
+            stage = "threshold"
             blurred = cv2.GaussianBlur(blackhat_norm, (5, 5), 0)
             binary = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 25, -4)
+            if lap: lap.mark("adaptive_threshold", binary)
             kernel_open = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
             binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel_open)
+            if lap: lap.mark("open", binary)
 
             # 8. Cleanup (FINAL VISUAL STAGE)
+            stage = "cleanup"
             kernel_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
             closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel_close)
+            if lap: lap.mark("close", closed)
             bool_img = closed > 0
-            cleaned = remove_small_objects(bool_img, min_size=100)
+            cleaned = morphology.remove_small_objects(bool_img, min_size=100)
             cleaned_uint8 = (cleaned * 255).astype(np.uint8)
+            if lap: lap.mark("remove_small_objects", cleaned_uint8)
 
             # --- INTERNAL MATH ONLY ---
-            skel = thin(cleaned)
+            stage = "vector"
+            skel = morphology.thin(cleaned)
             skel_uint8 = (skel * 255).astype(np.uint8)
+            if lap: lap.mark("thin", skel_uint8)
             features = self._calculate_vector(skel_uint8)
+            if lap: lap.mark("vector", features)
 
             # --- VISUALIZATION ---
             vis_img = cv2.cvtColor(cleaned_uint8, cv2.COLOR_GRAY2RGB)
+            if lap:
+                lap.mark("visualize", vis_img)
+                lap.done()
 
             return vis_img, features
 
         except Exception as e:
-            print(f"Extraction Error: {e}")
+            print(f"Extraction Error ({stage}): {e}")
+            self.failed_stage = stage
             return None, None
 
+    def vectorize_mask(self, mask):
+        """Re-derives the feature vector from a stored cleaned vein image (the saved img_*.jpg)."""
+        self.failed_stage = None
+        try:
+            cleaned = mask > 127  # Undo JPEG ringing around the binary strokes
+            skel = morphology.thin(cleaned)
+            return self._calculate_vector((skel * 255).astype(np.uint8))
+        except Exception as e:
+            print(f"Extraction Error (vector): {e}")
+            self.failed_stage = "vector"
+            return None
+
     def _get_rotated_roi(self, img):
         _, mask = cv2.threshold(img, 45, 255, cv2.THRESH_BINARY)
         kernel = np.ones((5,5), np.uint8)
@@ -361,7 +1353,75 @@ class VeinFeatureExtractor:
         roi = bg_removed[max(0, y-margin):min(img.shape[0], y+h+margin), max(0, x-margin):min(img.shape[1], x+w+margin)]
         return roi if roi.size > 0 else img
 
+    def _warp_roi_fast(self, gray, size=ROI_SIZE):
+        """Same ROI as _get_rotated_roi, but only the final size x size window is resampled from full resolution.
+
+        The mask and ellipse stay at full resolution with the same 5x5 morphology: it costs a few ms, and fitting
+        them on a decimated copy shifted the ROI by up to 10px on thin contour detail.
+        """
+        h, w = gray.shape[:2]
+        _, mask = cv2.threshold(gray, 45, 255, cv2.THRESH_BINARY)
+        kernel = np.ones((5,5), np.uint8)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        M = np.float32([[1, 0, 0], [0, 1, 0]])
+        if contours:
+            c = max(contours, key=cv2.contourArea)
+            pts = c.reshape(-1, 2).astype(np.float32)
+            if len(c) > 5:
+                (x, y), _, angle = cv2.fitEllipse(c)
+                rotation_angle = angle - 180 if angle > 90 else angle
+                if abs(rotation_angle) < 30: M = cv2.getRotationMatrix2D((x, y), rotation_angle, 1.0)
+        else:
+            pts = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+
+        rot_pts = cv2.transform(pts[None], M)[0]
+        x, y, bw, bh = cv2.boundingRect(rot_pts)
+        margin = 20
+        x1, y1 = max(0, x - margin), max(0, y - margin)
+        x2, y2 = min(w, x + bw + margin), min(h, y + bh + margin)
+        if x2 <= x1 or y2 <= y1: return None, None
+
+        # Full-res source -> rotate -> crop -> stretch to size x size, as one affine
+        sx, sy = size / (x2 - x1), size / (y2 - y1)
+        A = np.array([[sx, 0, -x1 * sx], [0, sy, -y1 * sy]]) @ np.vstack([M, [0, 0, 1]])
+
+        # Only the source window feeding the output is cut out and area-decimated before the warp
+        corners = np.float32([[0, 0], [size, 0], [size, size], [0, size]])
+        src_corners = cv2.transform(corners[None], cv2.invertAffineTransform(A))[0]
+        cx, cy, cw, ch = cv2.boundingRect(src_corners)
+        cx1, cy1 = max(0, cx - 1), max(0, cy - 1)
+        cx2, cy2 = min(w, cx + cw + 1), min(h, cy + ch + 1)
+        src = gray[cy1:cy2, cx1:cx2]
+        k = max(sx, sy)
+        if k < 1.0:
+            src = cv2.resize(src, (max(1, round(src.shape[1] * k)), max(1, round(src.shape[0] * k))), interpolation=cv2.INTER_AREA)
+        kx, ky = src.shape[1] / (cx2 - cx1), src.shape[0] / (cy2 - cy1)
+        A_src = np.hstack([A[:, :2] @ np.diag([1 / kx, 1 / ky]), (A[:, :2] @ [cx1, cy1] + A[:, 2])[:, None]])
+        roi = cv2.warpAffine(src, A_src, (size, size), flags=cv2.INTER_LINEAR)
+
+        hand_mask = np.zeros((size, size), np.uint8)
+        cv2.fillPoly(hand_mask, [np.round(cv2.transform(pts[None], A)[0]).astype(np.int32)], 255)
+        return roi, hand_mask
+
     def _calculate_vector(self, skel):
+        kernel = np.array([[1, 1, 1], [1, 10, 1], [1, 1, 1]], dtype=np.uint8)
+        # NOTE: uint8 output saturates at 255, so these counts are skeleton coverage rather than
+        # true minutiae. Enrolled templates depend on it; don't "fix" without re-enrolling.
+        neighbor_map = cv2.filter2D(skel, -1, kernel)
+        num_endpoints = np.sum(neighbor_map == 11)
+        num_bifurcations = np.sum(neighbor_map >= 13)
+        parts = [np.array([num_endpoints / 1000.0, num_bifurcations / 1000.0])]
+        for grid_size in self.grid_sizes:
+            parts.append(grid_densities(skel, grid_size).ravel())
+        vec = np.concatenate(parts).astype(np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def _calculate_vector_reference(self, skel):
+        """Original per-block loop (32px grid), kept to check and benchmark _calculate_vector."""
         kernel = np.array([[1, 1, 1], [1, 10, 1], [1, 1, 1]], dtype=np.uint8)
         neighbor_map = cv2.filter2D(skel, -1, kernel)
         num_endpoints = np.sum(neighbor_map == 11)
@@ -380,54 +1440,1184 @@ class VeinFeatureExtractor:
         norm = np.linalg.norm(vec)
         return vec / norm if norm > 0 else vec
 
+# ==================== TEMPLATE STORE ====================
+class TemplateStore:
+    """Append-only float32 vector file plus a JSON-lines record table.
+
+    Compaction and the legacy-index migration write the next generation of both files and then
+    atomically swap store.json to point at it, so a crash at any step leaves one complete generation.
+    The legacy index is read from the store's own root and left in place; store.json records that it was imported.
+    """
+    def __init__(self, root=DATABASE_DIR, dim=VECTOR_DIM):
+        self.root = Path(root)
+        self.manifest = self.root / "store.json"
+        self.legacy_index = self.root / INDEX_FILE.name
+        self.dim = dim
+        self.lock = threading.RLock()
+        self.opened = False
+        self.generation = 0
+        self.migrated = False    # Legacy index already imported into the live generation
+        self.rows = 0            # Rows in the vector file, including dead ones
+        self.records = []        # Row -> add record, None once deleted or never committed
+        self._students = {}      # Matric -> {"name", "faculty", "program", "templates"}
+
+    @property
+    def vector_file(self): return self.root / f"vectors_{self.generation}.f32"
+
+    @property
+    def record_file(self): return self.root / f"records_{self.generation}.jsonl"
+
+    @property
+    def row_bytes(self): return 4 * self.dim
+
+    @property
+    def dead_rows(self): return sum(1 for r in self.records if r is None)
+
+    def open(self):
+        with self.lock:
+            if self.opened: return
+            fresh = not self.manifest.exists()
+            if fresh: self._write_manifest(self.generation)
+            with open(self.manifest, 'r') as f: meta = json.load(f)
+            self.generation, self.dim = meta["generation"], meta["dim"]
+            self.migrated = meta.get("migrated", False)
+            self._sweep_generations()
+
+            # Drop a torn vector row left by a crash mid-append
+            self.vector_file.touch()
+            self.rows = self.vector_file.stat().st_size // self.row_bytes
+            with open(self.vector_file, 'r+b') as f: f.truncate(self.rows * self.row_bytes)
+
+            self.records = [None] * self.rows
+            self._students = {}
+            self.record_file.touch()
+            good_bytes = 0
+            with open(self.record_file, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b"\n"): break
+                    try: rec = json.loads(line)
+                    except ValueError: break
+                    self._apply(rec)
+                    good_bytes += len(line)
+            with open(self.record_file, 'r+b') as f: f.truncate(good_bytes)
+            self.opened = True
+
+            # Flagged only in the manifest that makes its generation live, so an interrupted migration resumes
+            if not self.migrated and self.legacy_index.exists(): self.import_json_index(self.legacy_index)
+
+    def students(self):
+        self.open()
+        return self._students
+
+    def vectors(self):
+        """Read-only memory map over every row; no copy is made."""
+        self.open()
+        if self.rows == 0: return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vector_file, dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+
+    def append(self, matric, name, faculty, program, hand, vec, img_path):
+        vec = np.ascontiguousarray(vec, dtype=np.float32).ravel()
+        if vec.size != self.dim: raise ValueError(f"Expected {self.dim}-dim vector, got {vec.size}")
+        with self.lock:
+            self.open()
+            # Vector is made durable before the record that references it
+            with open(self.vector_file, 'ab') as f:
+                f.write(vec.tobytes())
+                f.flush(); os.fsync(f.fileno())
+            row = self.rows
+            self.rows += 1
+            self.records.append(None)
+            rec = {"op": "add", "matric": matric, "name": name, "faculty": faculty, "program": program,
+                   "hand": hand, "row": row, "img_path": Path(img_path).as_posix()}
+            self._write_record(rec)
+            return row
+
+    def delete(self, matric):
+        with self.lock:
+            self.open()
+            if matric not in self._students: return False
+            self._write_record({"op": "del", "matric": matric})
+            return True
+
+    def compact(self):
+        with self.lock:
+            self.open()
+            old_vectors = self.vectors()
+            new_gen = self._write_generation(self._live_templates(old_vectors))
+            del old_vectors
+            self._write_manifest(new_gen)
+            self.opened = False
+            self.open()
+
+    def import_json_index(self, index_file):
+        """Migration from student_index.json + vec_*.npy; returns templates imported.
+
+        Live templates and the imported ones are written as the next generation, and store.json is swapped to
+        it with the migrated flag set in one step. Templates already in the store are skipped, so re-running
+        after an interrupted migration never duplicates rows.
+        """
+        with open(index_file, 'r') as f: data = json.load(f)
+        with self.lock:
+            self.open()
+            old_vectors = self.vectors()
+            present = {(m, old_vectors[t["row"]].tobytes()) for m, info in self._students.items() for t in info["templates"]}
+            imported = []
+            for matric, info in data.items():
+                for t in info["templates"]:
+                    vec_path = Path(t["path"].replace("\\", "/"))
+                    if not vec_path.exists(): continue
+                    vec = np.ascontiguousarray(np.load(vec_path), dtype=np.float32).ravel()
+                    if vec.size != self.dim: raise ValueError(f"{vec_path}: expected {self.dim}-dim vector, got {vec.size}")
+                    if (matric, vec.tobytes()) in present: continue
+                    present.add((matric, vec.tobytes()))
+                    img_path = Path(t.get("img_path", "").replace("\\", "/")).as_posix()
+                    imported.append((vec, matric, info["name"], info.get("faculty", ""), info.get("program", ""),
+                                     t.get("hand", "primary"), img_path))
+            new_gen = self._write_generation(itertools.chain(self._live_templates(old_vectors), imported)) if imported else self.generation
+            del old_vectors
+            self.migrated = True
+            self._write_manifest(new_gen)
+            if new_gen != self.generation:
+                self.opened = False
+                self.open()
+            return len(imported)
+
+    def _live_templates(self, vectors):
+        for matric, info in self._students.items():
+            for t in info["templates"]:
+                yield vectors[t["row"]], matric, info["name"], info["faculty"], info["program"], t["hand"], t["img_path"]
+
+    def _write_generation(self, templates):
+        """Writes (vec, matric, name, faculty, program, hand, img_path) rows as the next generation; store.json is not touched."""
+        new_gen = self.generation + 1
+        with open(self.root / f"vectors_{new_gen}.f32", 'wb') as vf, \
+             open(self.root / f"records_{new_gen}.jsonl", 'w', newline="\n") as rf:
+            for row, (vec, matric, name, faculty, program, hand, img_path) in enumerate(templates):
+                vf.write(np.ascontiguousarray(vec, dtype=np.float32).tobytes())
+                rec = {"op": "add", "matric": matric, "name": name, "faculty": faculty,
+                       "program": program, "hand": hand, "row": row, "img_path": img_path}
+                rf.write(json.dumps(rec) + "\n")
+            vf.flush(); os.fsync(vf.fileno())
+            rf.flush(); os.fsync(rf.fileno())
+        return new_gen
+
+    def _apply(self, rec):
+        if rec["op"] == "add":
+            if rec["row"] >= self.rows: return
+            self.records[rec["row"]] = rec
+            info = self._students.setdefault(rec["matric"], {
+                "name": rec["name"], "faculty": rec["faculty"], "program": rec["program"], "templates": []})
+            info["templates"].append({"hand": rec["hand"], "row": rec["row"], "img_path": rec["img_path"]})
+        elif rec["op"] == "del":
+            info = self._students.pop(rec["matric"], None)
+            if info:
+                for t in info["templates"]: self.records[t["row"]] = None
+
+    def _write_record(self, rec):
+        with open(self.record_file, 'a', newline="\n") as f:
+            f.write(json.dumps(rec) + "\n")
+            f.flush(); os.fsync(f.fileno())
+        self._apply(rec)
+
+    def _write_manifest(self, generation):
+        tmp = self.manifest.with_suffix(".tmp")
+        with open(tmp, 'w') as f:
+            json.dump({"generation": generation, "dim": self.dim, "migrated": self.migrated}, f)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.manifest)
+
+    def _sweep_generations(self):
+        keep = {self.vector_file.name, self.record_file.name}
+        for p in list(self.root.glob("vectors_*.f32")) + list(self.root.glob("records_*.jsonl")):
+            if p.name not in keep:
+                try: p.unlink()
+                except OSError: pass  # Still mapped on Windows; retried on next open
+
+# ==================== MATCH INDEX ====================
+def rank_students(scores, labels):
+    """Best (label, score) using the mean of each student's top-2 template scores."""
+    # Group rows by student, best score first within each group
+    order = np.lexsort((-scores, labels))
+    scores, labels = scores[order], labels[order]
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    counts = np.diff(np.r_[starts, len(labels)])
+    top1 = scores[starts]
+    top2 = scores[np.minimum(starts + 1, len(labels) - 1)]
+    student_scores = np.where(counts > 1, (top1 + top2) / 2, top1)
+    best = int(np.argmax(student_scores))
+    return int(labels[starts[best]]), student_scores[best]
+
+class ExactIndex:
+    """Linear scan: every live row is a candidate."""
+    name = "exact"
+
+    def build(self, vectors, rows): pass
+    def add(self, row, vec): pass
+    def remove(self, rows): pass
+    def stale(self): return False
+    def candidates(self, query): return None  # None = all live rows
+
+class IVFIndex:
+    """Inverted file over spherical k-means centroids; only the n_probe closest lists are scanned."""
+    name = "ivf"
+
+    def __init__(self, n_lists=None, n_probe=IVF_PROBES, iters=15, seed=0, recall_target=IVF_RECALL_TARGET):
+        self.n_lists = n_lists   # None = sqrt(gallery size)
+        self.n_probe = n_probe   # None until calibrated on the first build
+        self.calibrate = n_probe is None
+        self.recall_target = recall_target
+        self.iters = iters
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None
+        self.lists = []
+        self.trained_size = 0
+        self.size = 0
+
+    def build(self, vectors, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.centroids is None or self.stale(len(rows)):
+            self.centroids = self._train(np.asarray(vectors[rows]))
+            self.trained_size = len(rows)
+            if self.calibrate and self.centroids is not None: self.n_probe = self._calibrate(np.asarray(vectors[rows]))
+        self._assign(vectors, rows)
+
+    def _train(self, data):
+        if len(data) == 0: return None
+        k = min(len(data), self.n_lists or max(1, int(np.sqrt(len(data)))))
+        centroids = data[self.rng.choice(len(data), k, replace=False)].astype(np.float32)
+        for _ in range(self.iters):
+            assign = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            counts = np.bincount(assign, minlength=k)
+            empty = counts == 0
+            sums[empty] = data[self.rng.choice(len(data), int(empty.sum()))]  # Reseed empty lists
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        return centroids
+
+    def _calibrate(self, data, n_queries=200, noise=0.05):
+        """Smallest probe count whose lists hold the exact nearest row for recall_target of jittered templates."""
+        picks = self.rng.choice(len(data), min(n_queries, len(data)), replace=False)
+        queries = data[picks] + self.rng.normal(0, noise, (len(picks), data.shape[1])).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        nearest = np.argmax(queries @ data.T, axis=1)
+        home = np.argmax(data[nearest] @ self.centroids.T, axis=1)   # List each nearest row is assigned to
+        sims = queries @ self.centroids.T
+        rank = np.sum(sims > sims[np.arange(len(queries)), home][:, None], axis=1)   # Lists probed before it
+        needed = np.sort(rank + 1)
+        return int(needed[min(len(needed) - 1, int(np.ceil(self.recall_target * len(needed))) - 1)])
+
+    def _assign(self, vectors, rows):
+        if self.centroids is None:
+            self.lists, self.size = [], 0
+            return
+        assign = np.argmax(np.asarray(vectors[rows]) @ self.centroids.T, axis=1) if len(rows) else rows
+        self.lists = [rows[assign == i] for i in range(len(self.centroids))]
+        self.size = len(rows)
+
+    def stale(self, size=None):
+        # Retrain once the gallery has doubled (or halved) since the centroids were fitted
+        size = self.size if size is None else size
+        return self.centroids is None or size > 2 * self.trained_size or 2 * size < self.trained_size
+
+    def add(self, row, vec):
+        if self.centroids is None: return
+        i = int(np.argmax(self.centroids @ np.asarray(vec, dtype=np.float32)))
+        self.lists[i] = np.append(self.lists[i], row)
+        self.size += 1
+
+    def remove(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        self.lists = [l[~np.isin(l, rows)] for l in self.lists]
+        self.size = sum(len(l) for l in self.lists)
+
+    def candidates(self, query):
+        if self.centroids is None: return None
+        n_probe = min(self.n_probe, len(self.centroids))
+        sims = self.centroids @ query
+        probe = np.argpartition(-sims, n_probe - 1)[:n_probe]
+        return np.concatenate([self.lists[i] for i in probe])
+
+def make_index(kind=MATCH_INDEX):
+    if kind == "exact": return ExactIndex()
+    if kind == "ivf": return IVFIndex()
+    raise ValueError(f"Unknown match index: {kind}")
+
+# ==================== TEMPLATE GALLERY ====================
+class TemplateGallery:
+    """Scores a live vector against the memory-mapped store through a pluggable match index."""
+    def __init__(self, store, index=None):
+        self.store = store
+        self.index = index or make_index()
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.version = 0     # Bumped whenever row numbers or labels change
+        self.vectors = np.empty((0, store.dim), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int64)   # Student slot per store row, -1 if dead
+        self.matrics = []    # Slot -> matric
+        self.names = []      # Slot -> name
+        self.slots = {}      # Matric -> slot
+
+    def load(self):
+        with self.lock: self._load()
+
+    def _load(self):
+        self.vectors = self.store.vectors()
+        self.labels = np.full(self.store.rows, -1, dtype=np.int64)
+        self.matrics, self.names, self.slots = [], [], {}
+        for matric, info in self.store.students().items():
+            slot = self._slot(matric, info["name"])
+            for t in info["templates"]: self.labels[t["row"]] = slot
+        self.index.build(self.vectors, np.flatnonzero(self.labels >= 0))
+        self.version += 1
+        self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded: self.load()
+
+    def set_index(self, index):
+        with self.lock:
+            self.index = index
+            if self.loaded: self.index.build(self.vectors, np.flatnonzero(self.labels >= 0))
+
+    def _slot(self, matric, name):
+        if matric not in self.slots:
+            self.slots[matric] = len(self.matrics)
+            self.matrics.append(matric)
+            self.names.append(name)
+        return self.slots[matric]
+
+    def add(self, matric, name, faculty, program, hand, vec, img_path):
+        with self.lock:
+            row = self.store.append(matric, name, faculty, program, hand, vec, img_path)
+            if not self.loaded: return
+            self.vectors = self.store.vectors()  # Remap to cover the new row
+            self.labels = np.concatenate([self.labels, np.full(row + 1 - len(self.labels), -1, dtype=np.int64)])
+            self.labels[row] = self._slot(matric, name)
+            self.version += 1
+            self.index.add(row, self.vectors[row])
+            if self.index.stale(): self.index.build(self.vectors, np.flatnonzero(self.labels >= 0))
+
+    def remove(self, matric):
+        with self.lock:
+            if not self.store.delete(matric): return
+            if self.loaded and matric in self.slots:
+                # Tombstone the rows; the store is rewritten once enough of them pile up
+                rows = np.flatnonzero(self.labels == self.slots[matric])
+                self.labels[rows] = -1
+                self.version += 1
+                self.index.remove(rows)
+            if self.store.dead_rows >= COMPACT_DEAD_ROWS: self._compact()
+
+    def compact(self):
+        """Rewrites the store without dead rows; called on shutdown and by remove() past COMPACT_DEAD_ROWS."""
+        with self.lock:
+            if self.store.dead_rows: self._compact()
+
+    def _compact(self):
+        self.vectors = np.empty((0, self.store.dim), dtype=np.float32)  # Release the map before the swap
+        self.store.compact()
+        if self.loaded: self._load()
+
+    def __contains__(self, matric):
+        return matric in self.store.students()
+
+    def match(self, live_vec, shortlist=None):
+        """Returns (best_match, score) using the mean of each student's top-2 template scores."""
+        self.ensure_loaded()
+        query = np.asarray(live_vec, dtype=np.float32)
+        with self.lock:
+            if shortlist is not None:
+                vectors, labels = shortlist.view()
+                if len(labels) == 0: return None, 0
+                slot, best_score = rank_students(vectors @ query, labels)
+                if best_score <= 0: return None, 0
+                return {"matric": self.matrics[slot], "name": self.names[slot]}, best_score
+
+            rows = self.index.candidates(query)
+            if rows is None:
+                rows = np.flatnonzero(self.labels >= 0)
+                scores = (self.vectors @ query)[rows]
+            else:
+                scores = self.vectors[rows] @ query
+            if rows.size == 0: return None, 0
+            slot, best_score = rank_students(scores, self.labels[rows])
+            if best_score <= 0: return None, 0
+            return {"matric": self.matrics[slot], "name": self.names[slot]}, best_score
+
+def index_report(vectors, labels, probes=(1, 2, 4, 8, 16), n_queries=200, noise=0.05, seed=0):
+    """Recall@1 and latency of the IVF backend against the exact scan, using jittered enrolled templates as queries."""
+    rng = np.random.default_rng(seed)
+    live = np.flatnonzero(labels >= 0)
+    picks = rng.choice(live, min(n_queries, len(live)), replace=False)
+    queries = vectors[picks] + rng.normal(0, noise, (len(picks), vectors.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    def run(index):
+        hits, times, scanned = [], [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            rows = index.candidates(q)
+            if rows is None:
+                rows = live
+                scores = (vectors @ q)[rows]
+            else:
+                scores = vectors[rows] @ q
+            hits.append(rank_students(scores, labels[rows])[0] if rows.size else -1)
+            times.append((time.perf_counter() - t0) * 1000)
+            scanned.append(rows.size)
+        return np.array(hits), np.array(times), np.mean(scanned)
+
+    truth, times, scanned = run(ExactIndex())
+    report = [{"backend": "exact", "n_probe": None, "recall": 1.0, "mean_ms": times.mean(),
+               "p95_ms": np.percentile(times, 95), "scanned": scanned / len(live)}]
+    ivf = IVFIndex()
+    ivf.build(vectors, live)
+    hits, times, scanned = run(ivf)
+    report.append({"backend": "ivf-auto", "n_probe": ivf.n_probe, "recall": float(np.mean(hits == truth)),
+                   "mean_ms": times.mean(), "p95_ms": np.percentile(times, 95), "scanned": scanned / len(live)})
+    for n_probe in probes:
+        ivf.n_probe = n_probe
+        hits, times, scanned = run(ivf)
+        report.append({"backend": "ivf", "n_probe": n_probe, "recall": float(np.mean(hits == truth)),
+                       "mean_ms": times.mean(), "p95_ms": np.percentile(times, 95), "scanned": scanned / len(live)})
+    return report
+
+class Shortlist:
+    """Gallery sub-matrix for a fixed set of students, e.g. one exam's roster."""
+    def __init__(self, gallery, matrics):
+        self.gallery = gallery
+        self.matrics = set(matrics)
+        self.version = -1
+        self.vectors = np.empty((0, gallery.store.dim), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int64)
+
+    def view(self):
+        # Called under the gallery lock; re-gathered only after the gallery changes
+        if self.version != self.gallery.version:
+            slots = [self.gallery.slots[m] for m in self.matrics if m in self.gallery.slots]
+            rows = np.flatnonzero(np.isin(self.gallery.labels, slots))
+            self.vectors = np.ascontiguousarray(self.gallery.vectors[rows])
+            self.labels = self.gallery.labels[rows]
+            self.version = self.gallery.version
+        return self.vectors, self.labels
+
+    def __contains__(self, matric): return matric in self.matrics
+
+store = TemplateStore()
+gallery = TemplateGallery(store)
+
+class ExamRoster:
+    """One exam's ATTENDANCE entries keyed by matric, with the gallery shortlist of its students.
+
+    listen() keeps the entries current from a Firestore snapshot listener, so duplicate scans and table
+    lookups never leave the station. Status changes made here win over snapshots until Firestore echoes them.
+    """
+    def __init__(self, exam_id, entries):
+        self.exam_id = exam_id
+        self.entries = entries
+        self.shortlist = Shortlist(gallery, entries)
+        self.local = {}     # Matric -> status set here and not yet confirmed by a snapshot
+        self.lock = threading.Lock()
+        self.watch = None
+
+    def listen(self):
+        if db: self.watch = db.collection('ATTENDANCE').where('exam_id', '==', self.exam_id).on_snapshot(self._on_snapshot)
+        return self
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self.lock:
+            members = set(self.entries)
+            for change in changes:
+                doc = change.document
+                data = doc.to_dict() or {}
+                matric = data.get('matric_no', doc.id[len(self.exam_id) + 1:])
+                if change.type.name == 'REMOVED':
+                    self.entries.pop(matric, None)
+                    continue
+                local = self.local.get(matric)
+                if local is not None:
+                    if data.get('status') == local: del self.local[matric]
+                    else: data['status'] = local  # Our queued write hasn't reached Firestore yet
+                self.entries[matric] = data
+            if set(self.entries) != members: self.shortlist = Shortlist(gallery, self.entries)
+
+    def get(self, matric):
+        return self.entries.get(matric)
+
+    def set_status(self, matric, status):
+        with self.lock:
+            if matric in self.entries:
+                self.entries[matric]['status'] = status
+                self.local[matric] = status
+
+    def close(self):
+        if self.watch: self.watch.unsubscribe()
+        self.watch = None
+
+class BathroomLog:
+    """Students of one exam currently OUT, mirrored from BATHROOM_LOG by a listener and updated locally per scan."""
+    def __init__(self, exam_id):
+        self.exam_id = exam_id
+        self.prefix = f"{exam_id}_"
+        self.out = {}       # attendance_id -> (doc_id, exit_time, data)
+        self.local = {}     # doc_id -> OUT state written here and not yet confirmed by a snapshot
+        self.lock = threading.Lock()
+        self.watch = None
+
+    def _query(self):
+        # A range on one field needs no composite index; status is filtered client-side
+        return db.collection('BATHROOM_LOG').where('attendance_id', '>=', self.prefix).where('attendance_id', '<', self.prefix + '\uf8ff')
+
+    def load(self):
+        """Seeds the OUT-set (plus writes still in the journal) and starts the listener; False if offline."""
+        if not db: return False
+        try: docs = list(self._query().stream())
+        except: return False
+        with self.lock:
+            for doc in docs: self._apply(doc.id, doc.to_dict())
+            for doc_id, data in writer.pending_docs('BATHROOM_LOG').items():
+                if data is None or data.get('attendance_id', '').startswith(self.prefix):
+                    self._apply(doc_id, data)
+                    self.local[doc_id] = data is not None
+        self.watch = self._query().on_snapshot(self._on_snapshot)
+        return True
+
+    def _apply(self, doc_id, data):
+        """data None = document deleted."""
+        for att_id, entry in list(self.out.items()):
+            if entry[0] == doc_id: del self.out[att_id]
+        if data is not None and data.get('status') == 'OUT':
+            exit_time = data.get('exit_time')
+            if not isinstance(exit_time, datetime): exit_time = datetime.now(timezone.utc)  # Server timestamp still pending
+            self.out[data['attendance_id']] = (doc_id, exit_time, data)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self.lock:
+            for change in changes:
+                doc_id = change.document.id
+                data = None if change.type.name == 'REMOVED' else change.document.to_dict()
+                is_out = data is not None and data.get('status') == 'OUT'
+                if doc_id in self.local:
+                    if self.local[doc_id] != is_out: continue  # Our queued write is newer
+                    del self.local[doc_id]
+                self._apply(doc_id, data)
+
+    def mark(self, doc_id, data):
+        """Records a write queued elsewhere (e.g. undo); data None for a delete."""
+        with self.lock:
+            self._apply(doc_id, data)
+            self.local[doc_id] = data is not None
+
+    def toggle(self, attendance_id):
+        """("OUT", new doc id) or ("RETURNED", backup for undo); the Firestore write is queued."""
+        with self.lock:
+            entry = self.out.get(attendance_id)
+        if entry:
+            doc_id, _, data = entry
+            writer.delete('BATHROOM_LOG', doc_id)
+            self.mark(doc_id, None)
+            return "RETURNED", {'doc_id': doc_id, 'data': data}
+        doc_id = uuid.uuid4().hex[:20]
+        data = {'attendance_id': attendance_id, 'exit_time': SERVER_TIMESTAMP, 'status': 'OUT'}
+        writer.set('BATHROOM_LOG', doc_id, data)
+        self.mark(doc_id, data)
+        return "OUT", doc_id
+
+    def currently_out(self):
+        """[(matric, seconds out)], longest first."""
+        now = datetime.now(timezone.utc)
+        with self.lock: entries = [(att_id[len(self.prefix):], (now - exit_time).total_seconds()) for att_id, (_, exit_time, _) in self.out.items()]
+        return sorted(entries, key=lambda e: -e[1])
+
+    def close(self):
+        if self.watch: self.watch.unsubscribe()
+        self.watch = None
+
 # ==================== DATABASE HELPERS ====================
 def save_template(matric, name, faculty, program, features, img_rgb, hand_side="primary"):
     student_folder = TEMPLATES_DIR / matric / hand_side
     student_folder.mkdir(parents=True, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-    np.save(student_folder / f"vec_{timestamp}.npy", features)
+    img_path = student_folder / f"img_{timestamp}.jpg"
     save_img = img_rgb if len(img_rgb.shape) == 2 else cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-    cv2.imwrite(str(student_folder / f"img_{timestamp}.jpg"), save_img)
-    index_data = {}
-    if INDEX_FILE.exists():
-        with open(INDEX_FILE, 'r') as f: index_data = json.load(f)
-    if matric not in index_data:
-        index_data[matric] = {"name": name, "faculty": faculty, "program": program, "templates": []}
-    index_data[matric]["templates"].append({
-        "hand": hand_side, 
-        "path": str(student_folder / f"vec_{timestamp}.npy"),
-        "img_path": str(student_folder / f"img_{timestamp}.jpg")
-    })
-    with open(INDEX_FILE, 'w') as f: json.dump(index_data, f, indent=4)
-
-def find_match(live_vec):
-    if not INDEX_FILE.exists(): return None, 0
-    best_score = 0
-    best_match = None
-    with open(INDEX_FILE, 'r') as f: data = json.load(f)
-    for matric, info in data.items():
-        scores = []
-        for t in info["templates"]:
-            if os.path.exists(t["path"]):
-                saved = np.load(t["path"])
-                sim = np.dot(live_vec, saved)
-                scores.append(sim)
-        if scores:
-            s = np.mean(sorted(scores, reverse=True)[:2])
-            if s > best_score:
-                best_score = s
-                best_match = {"matric": matric, "name": info["name"]}
-    return best_match, best_score
+    cv2.imwrite(str(img_path), save_img)
+    gallery.add(matric, name, faculty, program, hand_side, features, img_path)
+
+def find_match(live_vec, shortlist=None):
+    return gallery.match(live_vec, shortlist)
+
+def exam_match(vector, roster=None):
+    """Matches against the exam roster first, then the whole gallery so a wrong hall can be reported."""
+    if roster:
+        match, score = find_match(vector, roster.shortlist)
+        if match and score >= MATCH_THRESHOLD: return match, score
+    return find_match(vector)
+
+def scan_outcome(vector, mode, exam_id, roster=None, bathroom=None, timing=None):
+    """Decides and records one exam/bathroom scan; the single path shared by the GUI and headless stations.
+
+    Returns {"command", "data"} for the LCD (command None when nothing is shown), "undo" (the transaction
+    perform_undo reverts, or None), "message" for the log and "matric" of the best match above threshold.
+    timing, if given, receives the match and write times in ms.
+    """
+    start = time.perf_counter()
+    match, score = exam_match(vector, roster)
+    matched = time.perf_counter()
+    conf_pct = int(score * 100)
+    outcome = {"command": "NOMATCH", "data": "", "undo": None, "matric": None, "message": f"NO MATCH FOUND ({conf_pct}%)"}
+    if match and score >= MATCH_THRESHOLD:
+        name, matric = match['name'], match['matric']
+        outcome["matric"] = matric
+        if mode == "exam" and exam_id:
+            table, doc_id = update_firebase_attendance(matric, exam_id, roster)
+            if table == "ALREADY_MARKED":
+                outcome.update(command="ERR_SCAN", message=f"STUDENT ALREADY SCANNED ({conf_pct}%)")
+            elif table:
+                outcome.update(command="ATTENDANCE", data=f"{matric}|{table}", message=f"{name}: TABLE {table} ({conf_pct}%)",
+                               undo={'type': 'attendance', 'matric': matric, 'doc_id': doc_id})
+            else: outcome["message"] = f"{matric} not in {exam_id} ({conf_pct}%)"
+        elif mode == "bathroom" and exam_id:
+            if roster and matric not in roster.entries: outcome["message"] = f"{matric} not in {exam_id} ({conf_pct}%)"
+            else:
+                res_type, payload = update_bathroom_log(f"{exam_id}_{matric}", bathroom)
+                curr_time = datetime.now().strftime("%I:%M %p")
+                if res_type == "OUT":
+                    # Payload is the new doc id
+                    outcome.update(command="BATH_OUT", data=f"{matric}|{curr_time}", message=f"{name}: OUT ({conf_pct}%)",
+                                   undo={'type': 'bathroom_out', 'matric': matric, 'doc_id': payload})
+                elif res_type == "RETURNED":
+                    # Payload is the deleted doc, restored on undo
+                    outcome.update(command="BATH_IN", data=f"{matric}|{curr_time}", message=f"{name}: RETURNED ({conf_pct}%)",
+                                   undo={'type': 'bathroom_return', 'matric': matric, 'backup_data': payload})
+                else: outcome["message"] = f"LOG ERROR ({conf_pct}%)"
+        else: outcome.update(command=None, message=f"{name} ({matric}, {conf_pct}%)")
+    if timing is not None: timing.update(match=(matched - start) * 1000, write=(time.perf_counter() - matched) * 1000)
+    return outcome
 
 def delete_user_data(matric):
-    if not INDEX_FILE.exists(): return
-    with open(INDEX_FILE, 'r') as f: data = json.load(f)
-    if matric in data:
-        del data[matric]
-        with open(INDEX_FILE, 'w') as f: json.dump(data, f, indent=4)
+    gallery.remove(matric)
     user_dir = TEMPLATES_DIR / matric
     if user_dir.exists(): shutil.rmtree(user_dir)
 
+# ==================== BATCH EXTRACTION ====================
+BATCH_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+_batch_extractor = None  # One extractor per worker process
+_batch_detector = None   # Hand detector for raw captures, created on a worker's first one
+
+def worker_settings():
+    """CLI-overridable settings that extraction workers must share; spawned workers re-import the defaults."""
+    return {"FAST_ROI": FAST_ROI, "REDUCED_DECODE": REDUCED_DECODE}
+
+def _init_batch_worker(settings=None):
+    global _batch_extractor
+    if settings: globals().update(settings)
+    _batch_extractor = VeinFeatureExtractor()
+
+def extraction_pool(workers=None):
+    """Process pool of VeinFeatureExtractor workers configured like this process."""
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(worker_settings(),))
+
+def _batch_extract_one(job):
+    path, from_mask, flip = job
+    img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    if img is None: return None, None, "decode"
+    if from_mask:
+        vec = _batch_extractor.vectorize_mask(img[:, :, 0])
+        return None, vec, _batch_extractor.failed_stage
+    if flip: img = cv2.flip(img, 1)
+    # Crop to the detected hand like perform_capture, so templates compare with live scans
+    global _batch_detector
+    if _batch_detector is None: _batch_detector = HandDetector()
+    found, bbox = _batch_detector.detect(img)
+    if not found: return None, None, "hand"
+    vis_img, vec = _batch_extractor.extract_features(img, bbox)
+    return vis_img, vec, _batch_extractor.failed_stage
+
+def collect_batch_jobs(root):
+    """(path, matric, hand, from_mask) for every image under <root>/<matric>/[<hand>/].
+
+    Stored img_*.jpg files are already cleaned vein masks, so only the vector stage is re-run on them.
+    """
+    root = Path(root)
+    jobs = []
+    for path in sorted(root.rglob("*")):
+        if path.suffix.lower() not in BATCH_IMAGE_EXTS: continue
+        parts = path.relative_to(root).parts
+        if len(parts) < 2: continue
+        hand = parts[1] if len(parts) > 2 else "primary"
+        jobs.append((path, parts[0], hand, path.name.startswith("img_")))
+    return jobs
+
+def batch_extract(root, workers=None, flip=False):
+    """Re-enrols every student found under root into the template store; returns a summary dict."""
+    jobs = collect_batch_jobs(root)
+    existing = {m: dict(info) for m, info in store.students().items()}
+    replaced = set()
+    old_images = []
+    failures = {}
+    enrolled = 0
+
+    start = time.perf_counter()
+    if not all(from_mask for *_, from_mask in jobs): ensure_hand_model()  # Before the workers race to download it
+    with extraction_pool(workers) as pool:
+        results = pool.map(_batch_extract_one, [(p, from_mask, flip) for p, _, _, from_mask in jobs], chunksize=4)
+        for (path, matric, hand, from_mask), (vis_img, vec, failed_stage) in zip(jobs, results):
+            if vec is None:
+                failures[failed_stage] = failures.get(failed_stage, 0) + 1
+                continue
+            info = existing.get(matric, {"name": matric, "faculty": "", "program": "", "templates": []})
+            # Old templates are dropped only once the student has a fresh one to replace them
+            if matric not in replaced:
+                if store.delete(matric): old_images += [t["img_path"] for t in info["templates"]]
+                replaced.add(matric)
+            if from_mask:
+                img_path = path
+            else:
+                folder = TEMPLATES_DIR / matric / hand
+                folder.mkdir(parents=True, exist_ok=True)
+                img_path = folder / f"img_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
+                cv2.imwrite(str(img_path), cv2.cvtColor(vis_img, cv2.COLOR_RGB2BGR))
+            store.append(matric, info["name"], info["faculty"], info["program"], hand, vec, img_path)
+            enrolled += 1
+    elapsed = time.perf_counter() - start
+
+    if store.dead_rows: store.compact()
+    kept = {Path(t["img_path"]) for info in store.students().values() for t in info["templates"]}
+    for p in old_images:
+        if Path(p) not in kept and Path(p).exists(): Path(p).unlink()
+    return {"images": len(jobs), "enrolled": enrolled, "students": len(replaced), "failures": failures,
+            "seconds": elapsed, "images_per_s": len(jobs) / elapsed if elapsed > 0 else 0.0}
+
+def fast_roi_regression(root, flip=False):
+    """Extracts every raw capture under root with and without FAST_ROI; returns the comparison summary.
+
+    Identity agreement is leave-one-out top-1 against the other captures' reference vectors, so it only
+    means something when root holds several students.
+    """
+    reference, fast = VeinFeatureExtractor(fast_roi=False), VeinFeatureExtractor(fast_roi=True)
+    matrics, ref_vecs, fast_vecs, ref_ms, fast_ms = [], [], [], [], []
+    for path, matric, _, from_mask in collect_batch_jobs(root):
+        if from_mask: continue
+        img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if img is None: continue
+        if flip: img = cv2.flip(img, 1)
+        t0 = time.perf_counter()
+        _, vr = reference.extract_features(img)
+        t1 = time.perf_counter()
+        _, vf = fast.extract_features(img)
+        t2 = time.perf_counter()
+        if vr is None or vf is None: continue
+        matrics.append(matric); ref_vecs.append(vr); fast_vecs.append(vf)
+        ref_ms.append((t1 - t0) * 1000); fast_ms.append((t2 - t1) * 1000)
+    if not matrics: return None
+
+    ref_vecs, fast_vecs = np.array(ref_vecs), np.array(fast_vecs)
+    similarity = np.sum(ref_vecs * fast_vecs, axis=1)
+    agree = []
+    if len(set(matrics)) > 1:
+        for q_ref, q_fast, i in zip(ref_vecs, fast_vecs, range(len(matrics))):
+            others = np.r_[0:i, i + 1:len(matrics)]
+            top_ref = matrics[others[np.argmax(ref_vecs[others] @ q_ref)]]
+            top_fast = matrics[others[np.argmax(ref_vecs[others] @ q_fast)]]
+            agree.append(top_ref == top_fast)
+    return {"images": len(matrics), "similarity": similarity, "id_agreement": np.mean(agree) if agree else None,
+            "ref_ms": float(np.mean(ref_ms)), "fast_ms": float(np.mean(fast_ms))}
+
+# ==================== MATCHING SERVICE ====================
+def _service_extract(job):
+    """Worker side of the service: capture JPEG -> (vein image, vector, failed stage)."""
+    data, bbox, source_size, mirrored = job
+    if bbox is not None:
+        crop, _ = decode_capture(data, bbox, mirrored, source_size=source_size)
+        if crop is None: return None, None, "crop"
+        vis_img, vec = _batch_extractor.extract_features(crop)
+    else:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None: return None, None, "decode"
+        if mirrored: img = cv2.flip(img, 1)
+        vis_img, vec = _batch_extractor.extract_features(img)
+    return vis_img, vec, _batch_extractor.failed_stage
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class MatchingService:
+    """Extractor process pool plus the warm template gallery behind a small HTTP API.
+
+    POST /identify     capture JPEG (query: bbox=x,y,w,h, size=w,h of the frame bbox is from, mirrored=0|1),
+                       or JSON {"vector": [...], "matrics": [...]} to match an already extracted vector
+    POST /enroll       capture JPEG (query: matric, name, faculty, program, hand, bbox, size, mirrored)
+    DELETE /students/<matric>
+    GET /health
+    Extraction runs in worker processes; matching runs in the request thread against the shared gallery.
+    """
+    def __init__(self, host=SERVICE_HOST, port=SERVICE_PORT, workers=None):
+        self.pool = extraction_pool(workers)
+        self.workers = self.pool._max_workers
+        self.enroll_lock = threading.Lock()   # Duplicate checks and the store append must not interleave
+        self.counts = {"identify": 0, "enroll": 0, "delete": 0, "errors": 0}
+        self.counts_lock = threading.Lock()   # Requests are handled on concurrent server threads
+        self.started = time.time()
+        gallery.ensure_loaded()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self): return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    def extract(self, data, bbox=None, source_size=None, mirrored=True):
+        vis_img, vec, failed_stage = self.pool.submit(_service_extract, (data, bbox, source_size, mirrored)).result()
+        if vec is None: raise ServiceError(422, f"Vein extraction failed at {failed_stage or 'unknown'} stage")
+        return vis_img, vec
+
+    def identify(self, data=None, vector=None, matrics=None, **capture):
+        start = time.perf_counter()
+        if vector is None: _, vector = self.extract(data, **capture)
+        shortlist = Shortlist(gallery, matrics) if matrics else None
+        match, score = find_match(np.asarray(vector, dtype=np.float32), shortlist)
+        self.count("identify")
+        return {"match": match if match and score >= MATCH_THRESHOLD else None, "best": match, "score": float(score),
+                "ms": (time.perf_counter() - start) * 1000}
+
+    def enroll(self, data, matric, name, faculty="", program="", hand="primary", **capture):
+        if not matric or not name: raise ServiceError(400, "matric and name are required")
+        vis_img, vec = self.extract(data, **capture)
+        with self.enroll_lock:
+            if matric in gallery: raise ServiceError(409, f"{matric} already registered")
+            match, score = find_match(vec)
+            if match and score > MATCH_THRESHOLD: raise ServiceError(409, f"Vein pattern registered as {match['matric']}")
+            save_template(matric, name, faculty, program, vec, vis_img, hand)
+        if writer: writer.set('STUDENT', matric, dict(student_doc(matric, name, faculty, program), registered_at=SERVER_TIMESTAMP), merge=True)
+        self.count("enroll")
+        return {"matric": matric, "templates": len(store.students()[matric]["templates"])}
+
+    def delete(self, matric):
+        if matric not in gallery: raise ServiceError(404, f"{matric} not registered")
+        delete_user_data(matric)
+        self.count("delete")
+        return {"deleted": matric}
+
+    def count(self, key):
+        with self.counts_lock: self.counts[key] += 1
+
+    def health(self):
+        with self.counts_lock: counts = dict(self.counts)
+        return {"students": len(store.students()), "workers": self.workers, "uptime_s": time.time() - self.started, **counts}
+
+    def _handler(self):
+        service = self
+
+        def ints(value, n):
+            if value is None: return None
+            parts = [int(v) for v in value.split(",")]
+            if len(parts) != n: raise ValueError(f"expected {n} comma-separated integers, got {value!r}")
+            return tuple(parts)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self, method):
+                url = urlparse(self.path)
+                q = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+                try:
+                    capture = {"bbox": ints(q.get("bbox"), 4), "source_size": ints(q.get("size"), 2),
+                               "mirrored": q.get("mirrored", "1") != "0"}
+                    if method == "GET" and url.path == "/health": return self._reply(200, service.health())
+                    if method == "POST" and url.path == "/identify":
+                        if self.headers.get("Content-Type", "").startswith("application/json"):
+                            req = json.loads(body)
+                            return self._reply(200, service.identify(vector=req["vector"], matrics=req.get("matrics")))
+                        return self._reply(200, service.identify(body, **capture))
+                    if method == "POST" and url.path == "/enroll":
+                        return self._reply(201, service.enroll(body, q.get("matric"), q.get("name"), q.get("faculty", ""),
+                                                               q.get("program", ""), q.get("hand", "primary"), **capture))
+                    if method == "DELETE" and url.path.startswith("/students/"):
+                        return self._reply(200, service.delete(url.path[len("/students/"):]))
+                    self._reply(404, {"error": "not found"})
+                except ServiceError as e:
+                    service.count("errors")
+                    self._reply(e.status, {"error": str(e)})
+                except (ValueError, KeyError, TypeError) as e:
+                    service.count("errors")
+                    self._reply(400, {"error": f"bad request: {e}"})
+                except Exception as e:  # Broken worker pool, disk errors: the client still gets an answer
+                    service.count("errors")
+                    self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+            def do_GET(self): self._dispatch("GET")
+            def do_POST(self): self._dispatch("POST")
+            def do_DELETE(self): self._dispatch("DELETE")
+            def log_message(self, *args): pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.shutdown(cancel_futures=True)
+        gallery.compact()
+
+class MatchingClient:
+    """Keep-alive client for MatchingService, one per station."""
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _params(self, bbox, source_size, mirrored):
+        params = {"mirrored": int(mirrored)}
+        if bbox is not None: params["bbox"] = ",".join(map(str, bbox))
+        if source_size is not None: params["size"] = ",".join(map(str, source_size))
+        return params
+
+    def _check(self, resp):
+        payload = resp.json()
+        if resp.status_code >= 400: raise ServiceError(resp.status_code, payload.get("error", resp.reason))
+        return payload
+
+    def identify(self, jpeg, bbox=None, source_size=None, mirrored=True):
+        return self._check(self.session.post(f"{self.url}/identify", data=jpeg, params=self._params(bbox, source_size, mirrored),
+                                             headers={"Content-Type": "image/jpeg"}, timeout=self.timeout))
+
+    def identify_vector(self, vector, matrics=None):
+        return self._check(self.session.post(f"{self.url}/identify", json={"vector": [float(v) for v in vector], "matrics": matrics},
+                                             timeout=self.timeout))
+
+    def enroll(self, jpeg, matric, name, faculty="", program="", hand="primary", bbox=None, source_size=None, mirrored=True):
+        params = dict(self._params(bbox, source_size, mirrored), matric=matric, name=name, faculty=faculty, program=program, hand=hand)
+        return self._check(self.session.post(f"{self.url}/enroll", data=jpeg, params=params,
+                                             headers={"Content-Type": "image/jpeg"}, timeout=self.timeout))
+
+    def delete(self, matric):
+        return self._check(self.session.delete(f"{self.url}/students/{matric}", timeout=self.timeout))
+
+    def health(self): return self._check(self.session.get(f"{self.url}/health", timeout=self.timeout))
+
+def service_benchmark(url, images, stations=(1, 2, 4, 8), requests_per_station=20):
+    """Identify throughput and latency with N stations posting captures concurrently; one row per N."""
+    jpegs = [Path(p).read_bytes() for p in images]
+    if not jpegs: raise ValueError("No benchmark images")
+    rows = []
+    for n in stations:
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def station(i):
+            client = MatchingClient(url)
+            for k in range(requests_per_station):
+                t0 = time.perf_counter()
+                try: client.identify(jpegs[(i * requests_per_station + k) % len(jpegs)])
+                except ServiceError:
+                    with lock: errors[0] += 1   # Extraction failures still cost a full round trip
+                ms = (time.perf_counter() - t0) * 1000
+                with lock: latencies.append(ms)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=station, args=(i,)) for i in range(n)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        elapsed = time.perf_counter() - start
+        lat = np.array(latencies)
+        rows.append({"stations": n, "requests": len(lat), "errors": errors[0], "req_per_s": len(lat) / elapsed,
+                     "p50_ms": float(np.percentile(lat, 50)), "p95_ms": float(np.percentile(lat, 95)), "max_ms": float(lat.max())})
+    return rows
+
+# ==================== STATIONS ====================
+class Station:
+    """One scanning point: its own stream, tracker, HD capture client, LCD board and capture lock.
+
+    Extraction is handed to a shared pool and matching uses the shared gallery, so stations only add
+    preview decode and hand tracking. mode is "exam", "bathroom" or "identify" (match and log only).
+    Each completed scan appends its phase timings (ms) to timings: ready (hand first seen -> ready), capture,
+    extract, match, write, scan (ready -> result on the LCD) and total, plus the LCD result.
+    """
+    def __init__(self, name, capture_url, stream_urls, extract, serial_port=None, mode="exam", exam_id=None, roster=None):
+        if mode not in ("exam", "bathroom", "identify"): raise ValueError(f"Station {name}: unknown mode {mode!r}")
+        self.name = name
+        self.mode = mode
+        self.exam_id = exam_id
+        self.extract = extract    # (jpeg, bbox, source_size, mirrored) -> (vein image, vector, failed stage)
+        self.camera = ThreadedCamera(stream_urls, downsample_scale=PREVIEW_SCALE, on_event=self.log)
+        self.capture_client = CaptureClient(capture_url)
+        self.lcd = LcdWriter(serial_port) if serial_port else None
+        self.capture_lock = threading.Lock()   # One capture in flight per station
+        self.tracker = None
+        self.tracking = None
+        self.roster = roster      # Preloaded ExamRoster; otherwise loaded from Firestore on start()
+        self.bathroom = None
+        self.last_result_id = 0
+        self.last_capture_time = 0
+        self.hand_since = None    # Time of the first tracking result of the current hand presentation
+        self.captures = 0
+        self.failures = 0
+        self.timings = deque(maxlen=50)
+
+    def log(self, msg): print(f"[{self.name}] {msg}")
+
+    def send(self, command, data="", delay=0.0):
+        if self.lcd: self.lcd.send(command, data, delay)
+
+    def start(self):
+        if self.lcd: self.lcd.start()
+        self.send("IDLE")
+        if self.exam_id and self.mode != "identify" and self.roster is None:
+            entries = load_exam_roster(self.exam_id)
+            if entries is not None:
+                self.roster = ExamRoster(self.exam_id, entries).listen()
+                self.log(f"Roster {self.exam_id}: {len(entries)} students")
+        if self.exam_id and self.mode == "bathroom":
+            bathroom = BathroomLog(self.exam_id)
+            if bathroom.load(): self.bathroom = bathroom
+            else: bathroom.close()
+        self.tracker = HandTracker()
+        self.camera.start()
+        self.tracking = TrackingWorker(self.camera, self.tracker, enabled=lambda: not self.capture_lock.locked()).start()
+        return self
+
+    def poll(self):
+        """Acts once on each new tracking result: prefetch while settling, capture when ready."""
+        result, result_id = self.tracking.latest() if self.tracking else (None, 0)
+        if result_id == self.last_result_id: return
+        self.last_result_id = result_id
+        if result is None or not result["found"]:
+            self.hand_since = None
+            return
+        if result["time"] <= self.last_capture_time or time.time() - result["time"] >= TRACK_RESULT_MAX_AGE: return
+        if self.hand_since is None: self.hand_since = result["time"]
+        if time.time() - self.last_capture_time <= CAPTURE_COOLDOWN: return
+        if result["settling"]: self.capture_client.prefetch()
+        if result["ready"] and self.capture_lock.acquire(blocking=False):
+            self.last_capture_time = time.time()
+            ready_ms = (result["time"] - self.hand_since) * 1000
+            self.hand_since = None
+            threading.Thread(target=self.capture, args=(result["box"], result["size"], ready_ms), daemon=True).start()
+
+    def capture(self, bbox, bbox_size, ready_ms=0.0):
+        start = time.perf_counter()
+        timing = {"ready": ready_ms}
+        try:
+            self.send("PROCESSING")
+            jpeg = self.capture_client.get()
+            timing["capture"] = (time.perf_counter() - start) * 1000
+            _, vector, failed_stage = self.extract((jpeg, bbox, bbox_size, True))
+            timing["extract"] = (time.perf_counter() - start) * 1000 - timing["capture"]
+            self.captures += 1
+            if vector is None:
+                self.failures += 1
+                self.log(f"Vein extraction failed at {failed_stage or 'unknown'} stage")
+                self.send("IDLE", delay=2.0)
+                return
+            self.handle(vector, timing)
+            timing["scan"] = (time.perf_counter() - start) * 1000
+            timing["total"] = ready_ms + timing["scan"]
+            self.timings.append(timing)
+        except Exception as e:
+            self.failures += 1
+            self.log(f"Error: {e}")
+            self.send("IDLE", delay=2.0)
+        finally:
+            self.capture_lock.release()
+
+    def handle(self, vector, timing=None):
+        """Records one scan through scan_outcome and shows it on the LCD; returns the LCD result."""
+        outcome = scan_outcome(vector, self.mode, self.exam_id, self.roster, self.bathroom, timing)
+        self.log(outcome["message"])
+        if outcome["command"]: self.send(outcome["command"], outcome["data"])
+        self.send("IDLE", delay=3.0)
+        result = outcome["command"] or "MATCH"
+        if timing is not None: timing["result"] = result
+        return result
+
+    def stats(self):
+        cam = self.camera.stats()
+        track = self.tracking.stats() if self.tracking else {"fps": 0.0, "infer_ms": 0.0, "skipped": 0}
+        latency = np.percentile([t["scan"] for t in self.timings], 50) if self.timings else 0.0
+        return {"name": self.name, "cam_fps": cam["fps"], "track_fps": track["fps"], "infer_ms": track["infer_ms"],
+                "captures": self.captures, "failures": self.failures, "p50_ms": float(latency)}
+
+    def stop(self):
+        if self.tracking: self.tracking.stop()
+        self.camera.stop()
+        self.capture_client.close()
+        if self.tracker:
+            with self.tracker.lock: self.tracker.close()
+        if self.roster: self.roster.close()
+        if self.bathroom: self.bathroom.close()
+        if self.lcd: self.lcd.close()
+
+def load_station_config(path):
+    """Station entries from a JSON file: {"stations": [{"name", "esp_ip" | "capture_url" + "stream_url",
+    "serial_port", "mode", "exam"}, ...]}; esp_ip expands to the ESP32's usual capture and stream URLs."""
+    with open(path) as f: entries = json.load(f)["stations"]
+    stations = []
+    for i, entry in enumerate(entries):
+        name = entry.get("name") or f"Station {i + 1}"
+        ip = entry.get("esp_ip")
+        capture_url = entry.get("capture_url") or (f"http://{ip}/capture" if ip else None)
+        stream_urls = entry.get("stream_urls") or ([entry["stream_url"]] if entry.get("stream_url") else
+                                                   [f"http://{ip}:81/stream", f"http://{ip}/stream"] if ip else None)
+        if not capture_url or not stream_urls: raise ValueError(f"{name}: needs esp_ip, or capture_url and stream_url")
+        stations.append({"name": name, "capture_url": capture_url, "stream_urls": stream_urls,
+                         "serial_port": entry.get("serial_port"), "mode": entry.get("mode", "exam"), "exam_id": entry.get("exam")})
+    names = [s["name"] for s in stations]
+    if len(set(names)) != len(names): raise ValueError("Station names must be unique")
+    return stations
+
+class StationHub:
+    """Runs N stations in one process around one extraction process pool and the shared template gallery."""
+    def __init__(self, config, workers=None):
+        self.pool = extraction_pool(workers)
+        self.stations = [Station(extract=self.extract, **entry) for entry in config]
+        self.stop_event = threading.Event()
+
+    def extract(self, job): return self.pool.submit(_service_extract, job).result()
+
+    def start(self):
+        gallery.ensure_loaded()
+        for _ in range(self.pool._max_workers): self.pool.submit(int)   # Spawn the workers before the first capture
+        ensure_hand_model()   # Fetched once, before the stations load it in parallel
+        with ThreadPoolExecutor(max_workers=len(self.stations)) as pool:   # Tracker model loads overlap
+            list(pool.map(Station.start, self.stations))
+        return self
+
+    def run(self, seconds=None, report_every=10.0):
+        deadline = time.monotonic() + seconds if seconds else None
+        next_report = time.monotonic() + report_every
+        while not self.stop_event.is_set() and (deadline is None or time.monotonic() < deadline):
+            for station in self.stations: station.poll()
+            if report_every and time.monotonic() >= next_report:
+                next_report += report_every
+                for st in self.stats():
+                    print(f"[{st['name']}] cam {st['cam_fps']:.1f} fps | track {st['track_fps']:.1f} fps ({st['infer_ms']:.0f}ms) | "
+                          f"captures {st['captures']} ({st['failures']} failed) | p50 {st['p50_ms']:.0f}ms")
+            self.stop_event.wait(STATION_POLL_INTERVAL)
+
+    def stats(self): return [station.stats() for station in self.stations]
+
+    def stop(self):
+        self.stop_event.set()
+        for station in self.stations: station.stop()
+        self.pool.shutdown(cancel_futures=True)
+
 # ==================== DATABASE GUI ====================
 class DatabaseManager:
     def __init__(self, parent):
@@ -455,11 +2645,8 @@ class DatabaseManager:
 
     def refresh(self):
         for i in self.tree.get_children(): self.tree.delete(i)
-        if INDEX_FILE.exists():
-            with open(INDEX_FILE, 'r') as f:
-                data = json.load(f)
-                for m, i in data.items():
-                    self.tree.insert('', tk.END, values=(m, i['name'], i.get('faculty','N/A'), len(i['templates'])))
+        for m, i in store.students().items():
+            self.tree.insert('', tk.END, values=(m, i['name'], i.get('faculty','N/A'), len(i['templates'])))
 
     def get_selected(self):
         sel = self.tree.selection()
@@ -475,7 +2662,7 @@ class DatabaseManager:
         viewer.configure(bg="black")
         frame = tk.Frame(viewer, bg="black")
         frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        with open(INDEX_FILE, 'r') as f: data = json.load(f)
+        data = store.students()
         if matric in data:
             for t in data[matric]['templates']:
                 if os.path.exists(t['img_path']):
@@ -507,12 +2694,21 @@ class PalmPass:
         self.root.geometry("1280x800")
         self.root.configure(bg="#0f1729")
         
+        self.startup = {}   # Milestone -> seconds since process start
         self.init_hardware()
         
-        self.tracker = HandTracker()
+        self.tracker = None      # HandTracker, built in the background by start_subsystems()
+        self.hd_detector = None  # IMAGE-mode landmarker, created on the first manual capture that needs it
+        self.capture_client = CaptureClient()
         self.extractor = VeinFeatureExtractor()
+        if PROFILE_STAGES: self.extractor.profiler = StageProfiler()
         
         self.cam_thread = None
+        self.tracking = None
+        self.last_result_id = 0
+        self.hand_since = None   # First tracking result of the hand being presented, for time-to-ready
+        self.scan_timings = deque(maxlen=50)   # Phase timings (ms) of recent exam/bathroom scans
+        self.ui_frame_times = deque(maxlen=30)
         self.is_streaming = False
         self.processing = False
         self.waiting_confirmation = False 
@@ -527,14 +2723,68 @@ class PalmPass:
         self.mode = tk.StringVar(value="registration")
         self.exam_subject = tk.StringVar()
         self.exam_map = {}
+        self.roster = None  # ExamRoster of the selected exam once loaded
+        self.bathroom = None  # BathroomLog of the selected exam in bathroom mode
+        self.out_list = None
+        self.out_job = None
         
         self.build_gui()
+        self.root.after(0, self.mark_startup, "window")
+        self.start_subsystems()
+        if AUTOSTART_STREAM: self.root.after(0, self.start_stream)
 
     def init_hardware(self):
         init_serial()
-        init_firebase()
+        init_writer(on_event=lambda msg: self.root.after(0, self.log, msg, "#f59e0b"))  # Runs once the GUI exists
+        pending, dead = writer.journal.counts()
+        if pending or dead: print(f"Replaying {pending} journaled Firestore writes ({dead} rejected)")
         send_lcd_command("IDLE")
 
+    # ==================== STARTUP ====================
+    SUBSYSTEMS = ("Firebase", "Hand tracker", "Templates", "Vein filters", "LCD")
+
+    def mark_startup(self, milestone):
+        self.startup.setdefault(milestone, time.perf_counter() - PROCESS_START)
+
+    def start_subsystems(self):
+        """Brings up the slow subsystems in parallel; the window is usable meanwhile."""
+        def load_tracker(): self.tracker = HandTracker()
+        tasks = {"Firebase": init_firebase, "Hand tracker": load_tracker,
+                 "Templates": gallery.ensure_loaded, "Vein filters": morphology.load}
+        pool = ThreadPoolExecutor(max_workers=len(tasks))
+        for name, task in tasks.items():
+            pool.submit(task).add_done_callback(lambda f, name=name: self.root.after(0, self.subsystem_done, name, f))
+        pool.shutdown(wait=False)
+        self.watch_lcd()
+
+    def subsystem_done(self, name, future):
+        error = future.exception()
+        ok = error is None and future.result() is not False
+        self.mark_startup(name)
+        label = self.ready_labels[name]
+        label.config(text=f"{'✔' if ok else '✖'} {name}  {self.startup[name]:.1f}s", fg="#22c55e" if ok else "#ef4444")
+        if error: self.log(f"{name} failed: {error}", "#dc2626")
+        if name == "Firebase" and ok:
+            writer.wake.set()  # Replay anything journaled while offline
+            if self.mode.get() != "registration": self.build_dynamic_controls()
+        self.report_startup()
+
+    def report_startup(self):
+        if all(n in self.startup for n in self.SUBSYSTEMS):
+            print("Startup: " + " | ".join(f"{k} {v:.2f}s" for k, v in sorted(self.startup.items(), key=lambda kv: kv[1])))
+
+    def watch_lcd(self, waited=0.0):
+        if lcd and lcd.ready.is_set():
+            self.mark_startup("LCD")
+            self.ready_labels["LCD"].config(text=f"✔ LCD  {self.startup['LCD']:.1f}s", fg="#22c55e")
+            self.report_startup()
+        elif waited >= 10:
+            self.ready_labels["LCD"].config(text="✖ LCD (not connected)", fg="#ef4444")
+            self.mark_startup("LCD")
+            self.report_startup()
+        else:
+            self.root.after(250, self.watch_lcd, waited + 0.25)
+
     def build_gui(self):
         main_frame = tk.Frame(self.root, bg="#0f1729")
         main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -575,6 +2825,13 @@ class PalmPass:
         self.status_label = tk.Label(left_panel, text="Offline", bg="#1e3a5f", fg="white", relief=tk.SOLID)
         self.status_label.pack(fill=tk.X, padx=15, pady=10, ipady=5)
 
+        ready_frame = tk.LabelFrame(left_panel, text="System", bg="#1a2332", fg="white")
+        ready_frame.pack(fill=tk.X, padx=15, pady=(0, 10))
+        self.ready_labels = {}
+        for name in self.SUBSYSTEMS:
+            self.ready_labels[name] = tk.Label(ready_frame, text=f"⏳ {name}", bg="#1a2332", fg="#94a3b8", anchor=tk.W)
+            self.ready_labels[name].pack(fill=tk.X, padx=5)
+
         # --- RIGHT PANEL ---
         right_panel = tk.Frame(main_frame, bg="#000000")
         right_panel.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -623,6 +2880,70 @@ class PalmPass:
             combo = ttk.Combobox(lbl, textvariable=self.exam_subject, values=display_list, state="readonly")
             if display_list: self.exam_subject.set(display_list[0])
             combo.pack(fill=tk.X, padx=5, pady=5)
+            combo.bind("<<ComboboxSelected>>", lambda e: self.load_roster())
+            if self.mode.get() == "exam":
+                tk.Button(lbl, text="🏁 Mark Remaining Absent", command=self.finalize_selected_exam, bg="#475569", fg="white").pack(fill=tk.X, padx=5, pady=(0, 5))
+            if self.mode.get() == "bathroom":
+                out_frame = tk.LabelFrame(self.dynamic_frame, text="Currently Out", bg="#1a2332", fg="white")
+                out_frame.pack(fill=tk.X, pady=(10, 0))
+                self.out_list = tk.Listbox(out_frame, height=6, bg="#0f1729", fg="#f59e0b", font=("Consolas", 10), borderwidth=0)
+                self.out_list.pack(fill=tk.X, padx=5, pady=5)
+                if self.out_job: self.root.after_cancel(self.out_job)
+                self.refresh_out_list()
+            self.load_roster()
+
+    def selected_exam_id(self):
+        selected_text = self.exam_subject.get()
+        return self.exam_map.get(selected_text, selected_text)
+
+    def load_roster(self):
+        """Preloads the selected exam's ATTENDANCE roster and keeps it live so scans are answered locally."""
+        exam_id = self.selected_exam_id()
+        if self.roster: self.roster.close()
+        if self.bathroom: self.bathroom.close()
+        self.roster = self.bathroom = None
+        if not exam_id: return
+        track_bathroom = self.mode.get() == "bathroom"
+
+        def worker():
+            entries = load_exam_roster(exam_id)
+            if entries is None or exam_id != self.selected_exam_id(): return
+            self.roster = ExamRoster(exam_id, entries).listen()
+            self.log(f"Roster {exam_id}: {len(entries)} students")
+            if track_bathroom:
+                bathroom = BathroomLog(exam_id)
+                if bathroom.load() and exam_id == self.selected_exam_id(): self.bathroom = bathroom
+                else: bathroom.close()
+        threading.Thread(target=worker, daemon=True).start()
+
+    def finalize_selected_exam(self):
+        exam_id = self.selected_exam_id()
+        if not db or not exam_id: return
+        if not messagebox.askyesno("Finalize", f"Mark every Pending student of {exam_id} as Absent?"): return
+
+        def worker():
+            progress = lambda done, total: self.root.after(0, lambda: self.status_label.config(text=f"Finalizing {done}/{total}..."))
+            try: written, errors = finalize_exam(exam_id, progress)
+            except Exception as e:
+                self.root.after(0, self.log, f"Finalize failed: {e}", "#dc2626")
+                return
+            self.root.after(0, self.log, f"{exam_id}: {written} marked Absent" + (f", {len(errors)} batches failed" if errors else ""),
+                            "#dc2626" if errors else "#22c55e")
+            self.root.after(0, lambda: self.status_label.config(text="Ready"))
+        threading.Thread(target=worker, daemon=True).start()
+
+    def refresh_out_list(self):
+        """Redraws the "Currently Out" list every second while it is on screen."""
+        if not self.out_list or not self.out_list.winfo_exists(): return
+        entries = self.bathroom.currently_out() if self.bathroom else []
+        tables = self.roster.entries if self.roster else {}
+        self.out_list.delete(0, tk.END)
+        for matric, seconds in entries:
+            table = tables.get(matric, {}).get('table_no', '-')
+            self.out_list.insert(tk.END, f"{matric:<12} T{table:<4} {int(seconds // 60):02d}:{int(seconds % 60):02d}")
+            if seconds >= BATHROOM_ALERT_MINUTES * 60: self.out_list.itemconfig(tk.END, fg="#ef4444")
+        if not entries: self.out_list.insert(tk.END, "Nobody out")
+        self.out_job = self.root.after(1000, self.refresh_out_list)
 
     def on_mode_change(self):
         self.build_dynamic_controls()
@@ -643,17 +2964,29 @@ class PalmPass:
         self.auto_btn.config(state=tk.NORMAL)
         self.capture_btn.config(state=tk.NORMAL)
         if self.update_job: self.root.after_cancel(self.update_job)
-        self.cam_thread = ThreadedCamera(STREAM_URL_PRIMARY, downsample_scale=PREVIEW_SCALE)
+        self.cam_thread = ThreadedCamera([STREAM_URL_PRIMARY, STREAM_URL_BACKUP], downsample_scale=PREVIEW_SCALE,
+                                         on_event=lambda msg: self.log(msg, "#f59e0b"))
         self.cam_thread.start()
+        self.ensure_tracking()
         self.update_loop()
 
+    def ensure_tracking(self):
+        """Starts hand tracking on the stream once the tracker has finished loading."""
+        if self.tracking or not self.tracker or not self.cam_thread: return
+        self.tracker.reset()
+        self.tracking = TrackingWorker(self.cam_thread, self.tracker,
+                                       enabled=lambda: not self.processing and not self.waiting_confirmation).start()
+
     def stop_stream(self):
         self.is_streaming = False
         self.stream_btn.config(text="▶ Start Stream", bg="#4caf50")
         self.auto_btn.config(state=tk.DISABLED, bg="#475569", text="⚡ Enable Auto-Capture")
         self.capture_btn.config(state=tk.DISABLED)
         self.auto_capture_enabled = False
+        self.capture_client.discard()
         if self.update_job: self.root.after_cancel(self.update_job)
+        if self.tracking: self.tracking.stop()
+        self.tracking = None
         if self.cam_thread: self.cam_thread.stop()
         self.video_canvas.delete("all")
         self.video_canvas.create_text(400, 300, text="Stopped", font=("Arial", 20), fill="#4b5563")
@@ -661,29 +2994,60 @@ class PalmPass:
     def toggle_auto(self):
         self.auto_capture_enabled = not self.auto_capture_enabled
         self.auto_btn.config(bg="#22c55e" if self.auto_capture_enabled else "#475569")
-        self.tracker.frames_stable = 0
+        if self.tracker: self.tracker.reset()
+        self.capture_client.discard()
 
     def update_loop(self):
         if not self.is_streaming: return
         if self.cam_thread:
-            status, frame = self.cam_thread.get_frame()
-            if status and not self.processing and not self.waiting_confirmation:
+            self.ensure_tracking()
+            status, frame, _, is_new = self.cam_thread.get_frame()
+            if status and is_new and not self.processing and not self.waiting_confirmation:
                 frame = cv2.flip(frame, 1)
-                found, quality, box = self.tracker.process(frame)
-                if found:
-                    x, y, w, h = box
+                self.cam_thread.release()
+                result, result_id = self.tracking.latest() if self.tracking else (None, 0)
+                if self.fresh_result(result):
+                    x, y, w, h = box = result["box"]
+                    quality = result["quality"]
                     color = (0, 255, 0) if quality > 80 else (0, 255, 255)
                     cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
                     cv2.putText(frame, f"Quality: {quality}%", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                    if self.auto_capture_enabled and self.tracker.is_ready():
-                        if time.time() - self.last_capture_time > CAPTURE_COOLDOWN:
+                    if result_id != self.last_result_id:  # Act once per inference, not once per redraw
+                        self.last_result_id = result_id
+                        if self.hand_since is None: self.hand_since = result["time"]
+                        cooled_down = time.time() - self.last_capture_time > CAPTURE_COOLDOWN
+                        if self.auto_capture_enabled and cooled_down and result["settling"]:
+                            self.capture_client.prefetch()  # HD frame is in flight before is_ready() fires
+                        if self.auto_capture_enabled and result["ready"] and cooled_down:
                             self.processing = True
                             self.last_capture_time = time.time()
-                            threading.Thread(target=self.perform_capture, args=(box,), daemon=True).start()
+                            ready_ms = (result["time"] - self.hand_since) * 1000
+                            self.hand_since = None
+                            threading.Thread(target=self.perform_capture, args=(box, result["size"], ready_ms), daemon=True).start()
                             cv2.putText(frame, "CAPTURING...", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                elif result is not None and not result["found"] and result_id != self.last_result_id:
+                    self.last_result_id = result_id
+                    self.hand_since = None
+                self.ui_frame_times.append(time.perf_counter())
+                times = self.ui_frame_times
+                ui_fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+                st = self.cam_thread.stats()
+                ts = self.tracking.stats() if self.tracking else {"fps": 0.0, "infer_ms": 0.0, "skipped": 0}
+                cv2.putText(frame, f"cam {st['fps']:.1f} fps | ui {ui_fps:.1f} fps | track {ts['fps']:.1f} fps ({ts['infer_ms']:.0f}ms, skipped {ts['skipped']})",
+                            (10, frame.shape[0] - 24), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (148, 163, 184), 1)
+                cv2.putText(frame, f"read {st['read_ms']:.0f}ms | drops {st['drops']} | reconnects {st['reconnects']}",
+                            (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (148, 163, 184), 1)
                 self.show_frame(frame)
+                if "first frame" not in self.startup:
+                    self.mark_startup("first frame")
+                    self.log(f"Time to first frame: {self.startup['first frame']:.2f}s (window at {self.startup.get('window', 0):.2f}s)")
         if self.is_streaming: self.update_job = self.root.after(40, self.update_loop)
 
+    def fresh_result(self, result):
+        """True for a hand found recently and after the last capture started."""
+        return result is not None and result["found"] and result["time"] > self.last_capture_time and \
+               time.time() - result["time"] < TRACK_RESULT_MAX_AGE
+
     def show_frame(self, frame):
         rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         w = self.video_canvas.winfo_width()
@@ -706,25 +3070,40 @@ class PalmPass:
                 messagebox.showinfo("Limit", "1 Sample captured.")
                 return
             self.processing = True
-            threading.Thread(target=self.perform_capture, args=(None,), daemon=True).start()
-
-    def perform_capture(self, bbox=None):
+            result = self.tracking.latest()[0] if self.tracking else None
+            args = (result["box"], result["size"]) if self.fresh_result(result) else (None, None)
+            threading.Thread(target=self.perform_capture, args=args, daemon=True).start()
+
+    def perform_capture(self, bbox=None, bbox_size=None, ready_ms=None):
+        """bbox_size is the (w, h) of the preview frame bbox was tracked on; the box is rescaled to the capture.
+
+        Exam/bathroom scans append their phase timings (ms) to scan_timings: ready (auto capture only), capture,
+        extract, match, write, scan (capture start -> result on the LCD), total and the LCD result.
+        """
+        start = time.perf_counter()
+        timing = {"ready": ready_ms}
         try:
             self.root.after(0, lambda: self.status_label.config(text="Processing..."))
             self.log("Capturing HD...")
             send_lcd_command("PROCESSING")
             
-            resp = requests.get(f"{CAPTURE_URL}?size={CAPTURE_SIZE}", timeout=8)
-            if resp.status_code != 200: raise Exception(f"Cam Error: {resp.status_code}")
-            hd_img = cv2.imdecode(np.frombuffer(resp.content, np.uint8), cv2.IMREAD_COLOR)
-            hd_img = cv2.flip(hd_img, 1)
+            jpeg = self.capture_client.get() if bbox is not None else self.capture_client.fetch()
+            timing["capture"] = (time.perf_counter() - start) * 1000
 
             if bbox is None:
-                found, _, hd_box = self.tracker.process(hd_img)
+                # No tracked hand in the preview: detect on the whole mirrored HD frame
+                hd_img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                hd_img = cv2.flip(hd_img, 1)
+                if self.hd_detector is None: self.hd_detector = HandDetector()
+                found, hd_box = self.hd_detector.detect(hd_img)
                 bbox = hd_box if found else (int(hd_img.shape[1]*0.2), int(hd_img.shape[0]*0.2), 400, 400)
-
-            vein_img, features = self.extractor.extract_features(hd_img, bbox)
+                vein_img, features = self.extractor.extract_features(hd_img, bbox)
+            else:
+                # Preview box rescaled to the capture, decoded straight to the mirrored red-channel crop
+                hand_img, _ = decode_capture(jpeg, bbox, source_size=bbox_size)
+                vein_img, features = self.extractor.extract_features(hand_img)
             if features is None: raise Exception("Vein Extract Failed")
+            timing["extract"] = (time.perf_counter() - start) * 1000 - timing["capture"]
 
             if self.mode.get() == "registration":
                 match, score = find_match(features)
@@ -733,23 +3112,32 @@ class PalmPass:
                     self.log(msg, "#ef4444")
                     send_lcd_command("ERR_VEIN")
                     self.root.after(0, lambda: messagebox.showwarning("Duplicate", msg))
-                    self.root.after(2000, lambda: send_lcd_command("IDLE"))
+                    send_lcd_command("IDLE", delay=2.0)
                     return 
                 self.waiting_confirmation = True
                 self.root.after(0, lambda: self.show_preview_dialog(vein_img, features))
             
-            elif self.mode.get() == "exam":
-                self.handle_attendance(features)
-            elif self.mode.get() == "bathroom":
-                self.handle_bathroom(features)
+            else:
+                timing["result"] = self.handle_scan(features, timing)
+                timing["scan"] = (time.perf_counter() - start) * 1000
+                timing["total"] = (ready_ms or 0.0) + timing["scan"]
+                self.scan_timings.append(timing)
+                time.sleep(1)
 
         except Exception as e:
             self.log(f"Error: {e}", "#dc2626")
             self.waiting_confirmation = False
-            self.root.after(2000, lambda: send_lcd_command("IDLE"))
+            send_lcd_command("IDLE", delay=2.0)
         finally:
             self.processing = False
-            self.root.after(0, lambda: self.status_label.config(text="Ready"))
+            status = "Ready"
+            profiler = self.extractor.profiler
+            if profiler:
+                status = f"Ready | {profiler.status_text()}"
+                if PROFILE_OUT:
+                    try: profiler.dump(PROFILE_OUT)
+                    except OSError as e: print(f"Profile dump failed: {e}")
+            self.root.after(0, lambda: self.status_label.config(text=status))
 
     # ==================== UNDO LOGIC ====================
     def perform_undo(self):
@@ -762,22 +3150,26 @@ class PalmPass:
         try:
             if action_type == 'attendance':
                 # Revert status to Pending and remove timestamp
-                db.collection('ATTENDANCE').document(tx['doc_id']).update({
+                writer.update('ATTENDANCE', tx['doc_id'], {
                     'status': 'Pending',
-                    'timestamp': firestore.DELETE_FIELD
+                    'timestamp': DELETE_FIELD
                 })
+                if self.roster: self.roster.set_status(matric, 'Pending')
                 self.log(f"Reset {matric}'s status to Pending", "#f59e0b")
                 send_lcd_command("IDLE") # Clear display
                 
             elif action_type == 'bathroom_out':
                 # Student was marked OUT, so we delete that entry (as if they never left)
-                db.collection('BATHROOM_LOG').document(tx['doc_id']).delete()
+                writer.delete('BATHROOM_LOG', tx['doc_id'])
+                if self.bathroom: self.bathroom.mark(tx['doc_id'], None)
                 self.log(f"Undo OUT for {matric}", "#f59e0b")
                 
             elif action_type == 'bathroom_return':
                 # Student was marked RETURNED (doc deleted), so we restore the doc
                 # This puts them back in "OUT" status
-                db.collection('BATHROOM_LOG').add(tx['backup_data'])
+                backup = tx['backup_data']
+                writer.set('BATHROOM_LOG', backup['doc_id'], backup['data'])
+                if self.bathroom: self.bathroom.mark(backup['doc_id'], backup['data'])
                 self.log(f"Undo RETURN for {matric} (Status: OUT)", "#f59e0b")
 
             self.last_transaction = None
@@ -787,92 +3179,27 @@ class PalmPass:
             self.log(f"Undo Failed: {e}", "#dc2626")
 
     # ==================== HANDLERS ====================
-    def handle_attendance(self, vector):
-        match, score = find_match(vector)
-        conf_pct = int(score * 100)
-        
-        if match and score >= MATCH_THRESHOLD:
-            name = match['name']
-            matric = match['matric']
-            selected_text = self.exam_subject.get()
-            raw_exam_id = self.exam_map.get(selected_text, selected_text)
-            
-            # Helper now returns doc_id too
-            table, doc_id = update_firebase_attendance(matric, raw_exam_id)
-            
-            if table == "ALREADY_MARKED": 
-                self.log(f"STUDENT ALREADY SCANNED ({conf_pct}%)", "#ef4444") 
-                send_lcd_command("ERR_SCAN")
-            elif table:
-                self.log(f"{name}: TABLE {table} ({conf_pct}%)", "#22c55e") 
-                send_lcd_command("ATTENDANCE", f"{matric}|{table}")
-                
-                # SAVE STATE FOR UNDO
-                self.last_transaction = {
-                    'type': 'attendance',
-                    'matric': matric,
-                    'doc_id': doc_id
-                }
-                self.root.after(0, lambda: self.undo_btn.config(state=tk.NORMAL))
-            else: 
-                msg = f"{matric} not in {raw_exam_id}"
-                self.log(f"{msg} ({conf_pct}%)", "#ef4444") 
-                send_lcd_command("NOMATCH")
-                self.root.after(0, lambda: messagebox.showwarning("Not Found", f"{matric} record not found in {raw_exam_id}"))
-        else: 
-            self.log(f"NO MATCH FOUND ({conf_pct}%)", "#ef4444") 
-            send_lcd_command("NOMATCH")
-        
-        self.root.after(3000, lambda: send_lcd_command("IDLE"))
-        time.sleep(1)
-
-    def handle_bathroom(self, vector):
-        match, score = find_match(vector)
-        conf_pct = int(score * 100)
-        
-        if match and score >= MATCH_THRESHOLD:
-            name = match['name']
-            matric = match['matric']
-            selected_text = self.exam_subject.get()
-            raw_exam_id = self.exam_map.get(selected_text, selected_text)
-            att_id = f"{raw_exam_id}_{matric}"
-            
-            # Helper now returns payload data
-            res_type, payload = update_bathroom_log(att_id)
-            curr_time = datetime.now().strftime("%I:%M %p")
-
-            if res_type == "OUT":
-                self.log(f"{name}: OUT ({conf_pct}%)", "#f59e0b") 
-                send_lcd_command("BATH_OUT", f"{matric}|{curr_time}")
-                
-                # SAVE UNDO (Payload is the new Doc ID)
-                self.last_transaction = {
-                    'type': 'bathroom_out',
-                    'matric': matric,
-                    'doc_id': payload 
-                }
-                self.root.after(0, lambda: self.undo_btn.config(state=tk.NORMAL))
-                
-            elif res_type == "RETURNED":
-                self.log(f"{name}: RETURNED ({conf_pct}%)", "#22c55e") 
-                send_lcd_command("BATH_IN", f"{matric}|{curr_time}")
-                
-                # SAVE UNDO (Payload is the deleted data)
-                self.last_transaction = {
-                    'type': 'bathroom_return',
-                    'matric': matric,
-                    'backup_data': payload
-                }
-                self.root.after(0, lambda: self.undo_btn.config(state=tk.NORMAL))
-            else: 
-                self.log(f"LOG ERROR ({conf_pct}%)", "#ef4444") 
-                send_lcd_command("NOMATCH")
-        else: 
-            self.log(f"NO MATCH FOUND ({conf_pct}%)", "#ef4444") 
-            send_lcd_command("NOMATCH")
-        
-        self.root.after(3000, lambda: send_lcd_command("IDLE"))
-        time.sleep(1)
+    def handle_scan(self, vector, timing=None):
+        """Records one exam/bathroom scan and shows it; returns the LCD result command."""
+        exam_id = self.selected_exam_id()
+        mode = self.mode.get()
+        roster = self.roster if self.roster and self.roster.exam_id == exam_id else None
+        bathroom = self.bathroom if self.bathroom and self.bathroom.exam_id == exam_id else None
+        outcome = scan_outcome(vector, mode, exam_id, roster, bathroom, timing)
+        command = outcome["command"]
+        color = {"ATTENDANCE": "#22c55e", "BATH_IN": "#22c55e", "BATH_OUT": "#f59e0b"}.get(command, "#ef4444")
+        self.log(outcome["message"], color)
+        if command: send_lcd_command(command, outcome["data"])
+
+        if outcome["undo"]:
+            self.last_transaction = outcome["undo"]
+            self.root.after(0, lambda: self.undo_btn.config(state=tk.NORMAL))
+        elif mode == "exam" and command == "NOMATCH" and outcome["matric"]:
+            matric = outcome["matric"]
+            self.root.after(0, lambda: messagebox.showwarning("Not Found", f"{matric} record not found in {exam_id}"))
+        
+        send_lcd_command("IDLE", delay=3.0)
+        return command
 
     def center_window(self, window, width, height):
         x = (window.winfo_screenwidth() // 2) - (width // 2)
@@ -964,25 +3291,17 @@ class PalmPass:
             matric = matric_entry.get()
             
             # --- CHECK: Does matric already exist textually? ---
-            if INDEX_FILE.exists():
-                with open(INDEX_FILE, 'r') as f: index_data = json.load(f)
-                if matric in index_data:
-                    messagebox.showwarning("Duplicate", f"{matric} already registered")
-                    return
+            if matric in gallery:
+                messagebox.showwarning("Duplicate", f"{matric} already registered")
+                return
 
             if name and matric:
                 for vec, img in self.temp_samples:
                     save_template(matric, name, fac_var.get(), prog_var.get(), vec, img, "primary")
                 
-                if db:
-                    program_code = prog_var.get().split()[0]
-                    db.collection('STUDENT').document(matric).set({
-                        'name': name, 
-                        'matric_no': matric, 
-                        'faculty': fac_var.get(), 
-                        'program': program_code,
-                        'registered_at': firestore.SERVER_TIMESTAMP
-                    }, merge=True)
+                data = student_doc(matric, name, fac_var.get(), prog_var.get())
+                data['registered_at'] = SERVER_TIMESTAMP
+                writer.set('STUDENT', matric, data, merge=True)
                 
                 # LCD: ID: Matric / REGISTERED
                 send_lcd_command("REGISTERED", matric)
@@ -990,11 +3309,175 @@ class PalmPass:
                 messagebox.showinfo("Success", f"VEIN PATTERN REGISTERED AS {matric}")
                 self.temp_samples = []
                 dialog.destroy()
-                self.root.after(2000, lambda: send_lcd_command("IDLE"))
+                send_lcd_command("IDLE", delay=2.0)
         
         tk.Button(dialog, text="Save", command=save, bg="#22c55e", fg="white").pack(pady=20)
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = PalmPass(root)
-    root.mainloop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="PalmPass palm vein station")
+    parser.add_argument("--migrate", action="store_true", help="import student_index.json templates into the packed store and exit")
+    parser.add_argument("--compact", action="store_true", help="rewrite the packed store without deleted rows and exit")
+    parser.add_argument("--finalize-exam", metavar="EXAM_ID", help="mark every Pending ATTENDANCE entry of the exam as Absent and exit")
+    parser.add_argument("--sync-students", action="store_true", help="upsert STUDENT documents for every enrolled student and exit")
+    parser.add_argument("--import-roster", nargs=2, metavar=("EXAM_ID", "CSV"), help="create ATTENDANCE entries from a matric_no,table_no CSV and exit")
+    parser.add_argument("--serve", action="store_true", help="run the headless matching service (identify/enroll/delete over HTTP)")
+    parser.add_argument("--host", default=SERVICE_HOST, help="--serve bind address")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="--serve port")
+    parser.add_argument("--bench-service", metavar="N,N,...", help="identify throughput with N concurrent stations, e.g. 1,2,4,8; exits")
+    parser.add_argument("--service-url", help="benchmark this running service instead of starting one in-process")
+    parser.add_argument("--images", metavar="DIR", help="raw capture JPEGs (or recorded sessions) posted by --bench-service")
+    parser.add_argument("--requests", type=int, default=20, help="identify requests per station for --bench-service")
+    parser.add_argument("--stations", metavar="CONFIG", help="run the stations in a JSON config headless in one process (shared extraction pool and gallery)")
+    parser.add_argument("--flush-journal", action="store_true", help="send journaled Firestore writes left by a previous run and exit")
+    parser.add_argument("--index-report", action="store_true", help="print IVF recall/latency against the exact scan and exit")
+    parser.add_argument("--probes", default="1,2,4,8,16", help="comma-separated IVF probe counts for --index-report")
+    parser.add_argument("--match-index", choices=("exact", "ivf"), help=f"gallery search backend (default {MATCH_INDEX})")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N", help="run --index-report on N synthetic students instead of the store")
+    parser.add_argument("--batch-extract", metavar="DIR", help="re-enrol from DIR/<matric>/[<hand>/]*.jpg (raw captures or stored img_*.jpg) and exit")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for --batch-extract (default: CPU count)")
+    parser.add_argument("--flip", action="store_true", help="mirror raw captures like perform_capture does")
+    parser.add_argument("--bench-vector", type=int, nargs="?", const=200, metavar="N", help="time _calculate_vector against the original loop on N skeletons and exit")
+    parser.add_argument("--check-fast-roi", metavar="DIR", help="compare FAST_ROI vectors with the full-resolution path on DIR/<matric>/*.jpg and exit")
+    parser.add_argument("--tolerance", type=float, default=FAST_ROI_TOLERANCE, help="minimum cosine similarity for --check-fast-roi")
+    parser.add_argument("--fast-roi", action="store_true", help="use the decimated ROI fast path for captures")
+    parser.add_argument("--reduced-decode", action="store_true", help="decode auto captures at reduced JPEG scale when the hand is large enough")
+    parser.add_argument("--capture-url", help=f"override the HD capture endpoint (default {CAPTURE_URL})")
+    parser.add_argument("--stream-url", help=f"override the MJPEG preview stream (default {STREAM_URL_PRIMARY})")
+    parser.add_argument("--serial-port", help=f"override the LCD board's serial port (default {SERIAL_PORT})")
+    parser.add_argument("--stream-backup-url", help=f"override the fallback stream (default {STREAM_URL_BACKUP})")
+    parser.add_argument("--adaptive-tracking", action="store_true", help="track on a crop around the last hand box and skip frames while it is still")
+    parser.add_argument("--track-stride", type=int, default=None, metavar="N", help=f"with --adaptive-tracking, infer on 1 of N frames while stable (default {TRACK_STABLE_STRIDE})")
+    parser.add_argument("--autostart", action="store_true", help="start the preview stream on launch and log the time to first frame")
+    parser.add_argument("--profile", action="store_true", help="record per-stage extraction timings and show them in the status bar")
+    parser.add_argument("--profile-out", metavar="FILE", help="also write the timings to FILE after each capture (.json or .prom)")
+    args = parser.parse_args()
+    if args.match_index:
+        MATCH_INDEX = args.match_index
+        gallery.set_index(make_index(MATCH_INDEX))
+
+    if args.migrate:
+        if not store.legacy_index.exists(): print(f"Nothing to migrate: {store.legacy_index} not found")
+        else:
+            store.open()  # Opening imports (or resumes importing) the legacy index
+            print(f"Migrated into {store.vector_file}: {store.rows} templates for {len(store.students())} students")
+    elif args.index_report:
+        if args.synthetic:
+            rng = np.random.default_rng(0)
+            profile = np.abs(rng.normal(0.5, 0.2, VECTOR_DIM))
+            base = np.abs(profile + rng.normal(0, 0.15, (args.synthetic, VECTOR_DIM)))
+            vectors = np.repeat(base, 2, axis=0) + rng.normal(0, 0.03, (2 * args.synthetic, VECTOR_DIM))
+            vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+            labels = np.repeat(np.arange(args.synthetic), 2)
+        else:
+            gallery.load()
+            vectors, labels = np.asarray(gallery.vectors), gallery.labels
+        if not (labels >= 0).any(): print("Gallery is empty")
+        else:
+            probes = [int(p) for p in args.probes.split(",")]
+            print(f"{'backend':<8}{'probes':>7}{'recall@1':>10}{'mean ms':>10}{'p95 ms':>10}{'scanned':>10}")
+            for r in index_report(vectors, labels, probes):
+                print(f"{r['backend']:<8}{r['n_probe'] or '-':>7}{r['recall']:>10.3f}{r['mean_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['scanned']:>9.1%}")
+    elif args.batch_extract:
+        summary = batch_extract(args.batch_extract, args.workers, args.flip)
+        print(f"{summary['enrolled']}/{summary['images']} images enrolled for {summary['students']} students "
+              f"in {summary['seconds']:.1f}s ({summary['images_per_s']:.1f} images/s)")
+        for stage, count in sorted(summary["failures"].items()): print(f"  failed at {stage}: {count}")
+    elif args.bench_vector:
+        extractor = VeinFeatureExtractor()
+        rng = np.random.default_rng(0)
+        skels = [(morphology.thin(rng.random((ROI_SIZE, ROI_SIZE)) > 0.6) * 255).astype(np.uint8) for _ in range(args.bench_vector)]
+        timings, outputs = {}, {}
+        for name, fn in (("loop", extractor._calculate_vector_reference), ("vectorized", extractor._calculate_vector)):
+            start = time.perf_counter()
+            outputs[name] = [fn(sk) for sk in skels]
+            timings[name] = (time.perf_counter() - start) / len(skels) * 1e6
+        identical = all(a.tobytes() == b.tobytes() for a, b in zip(outputs["loop"], outputs["vectorized"]))
+        print(f"loop {timings['loop']:.0f}us  vectorized {timings['vectorized']:.0f}us  "
+              f"speedup {timings['loop'] / timings['vectorized']:.1f}x  bit-identical: {identical}")
+    elif args.check_fast_roi:
+        result = fast_roi_regression(args.check_fast_roi, args.flip)
+        if result is None: sys.exit(f"No extractable captures under {args.check_fast_roi}")
+        sim = result["similarity"]
+        failed = int(np.sum(sim < args.tolerance))
+        print(f"{result['images']} captures: cosine min {sim.min():.4f} mean {sim.mean():.4f}, "
+              f"{failed} below {args.tolerance}")
+        if result["id_agreement"] is not None: print(f"top-1 identity agreement: {result['id_agreement']:.1%}")
+        print(f"full-res {result['ref_ms']:.0f}ms  fast {result['fast_ms']:.0f}ms  "
+              f"speedup {result['ref_ms'] / result['fast_ms']:.2f}x")
+        sys.exit(1 if failed else 0)
+    elif args.compact:
+        dead = store.dead_rows
+        store.compact()
+        print(f"Compacted {store.vector_file}: {dead} dead rows dropped, {store.rows} kept")
+    elif args.finalize_exam or args.sync_students or args.import_roster:
+        if not init_firebase(): sys.exit("Firebase unavailable")
+        init_writer()
+        progress = lambda done, total: print(f"\r{done}/{total} written", end="", flush=True)
+        t0 = time.perf_counter()
+        if args.finalize_exam: written, errors = finalize_exam(args.finalize_exam, progress)
+        elif args.sync_students: written, errors = sync_students(progress)
+        else: written, errors = import_roster(*args.import_roster, progress=progress)
+        print(f"\n{written} documents written in {time.perf_counter() - t0:.1f}s")
+        for doc_id, err in errors: print(f"  batch starting at {doc_id} failed: {err}")
+        writer.stop()
+    elif args.serve:
+        FAST_ROI = FAST_ROI or args.fast_roi
+        REDUCED_DECODE = REDUCED_DECODE or args.reduced_decode
+        if init_firebase(): init_writer()
+        service = MatchingService(args.host, args.port, args.workers).start()
+        print(f"Matching service on {service.url} ({service.workers} extraction workers, {len(store.students())} students)")
+        try:
+            while True: time.sleep(1)
+        except KeyboardInterrupt:
+            service.stop()
+    elif args.bench_service:
+        FAST_ROI = FAST_ROI or args.fast_roi
+        REDUCED_DECODE = REDUCED_DECODE or args.reduced_decode
+        # Stored img_*.jpg are cleaned vein masks, not captures; only raw captures exercise the pipeline
+        if not args.images: sys.exit("--bench-service needs --images DIR of raw captures")
+        images = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in BATCH_IMAGE_EXTS)
+        if not images: sys.exit(f"No capture images under {args.images}")
+        service = None if args.service_url else MatchingService(port=0, workers=args.workers).start()
+        url = args.service_url or service.url
+        print(f"{len(images)} images against {url}")
+        print(f"{'stations':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'errors':>7}")
+        for row in service_benchmark(url, images, [int(n) for n in args.bench_service.split(",")], args.requests):
+            print(f"{row['stations']:>8} {row['req_per_s']:>8.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['max_ms']:>8.1f} {row['errors']:>7}")
+        if service: service.stop()
+    elif args.stations:
+        FAST_ROI = FAST_ROI or args.fast_roi
+        REDUCED_DECODE = REDUCED_DECODE or args.reduced_decode
+        ADAPTIVE_TRACKING = ADAPTIVE_TRACKING or args.adaptive_tracking
+        TRACK_STABLE_STRIDE = args.track_stride or TRACK_STABLE_STRIDE
+        if init_firebase(): init_writer()
+        hub = StationHub(load_station_config(args.stations), args.workers).start()
+        print(f"{len(hub.stations)} stations running on {hub.pool._max_workers} extraction workers")
+        try: hub.run()
+        except KeyboardInterrupt: pass
+        hub.stop()
+        if writer: writer.stop()
+    elif args.flush_journal:
+        if not init_firebase(): sys.exit("Firebase unavailable; writes stay in the journal")
+        init_writer()
+        pending, dead = writer.journal.counts()
+        print(f"Flushing {pending} queued writes...")
+        drained = writer.flush(timeout=120)
+        pending, dead = writer.journal.counts()
+        writer.stop()
+        print(f"{'Done' if drained else 'Timed out'}: {pending} pending, {dead} rejected (see {WRITE_JOURNAL})")
+    else:
+        PROFILE_STAGES = PROFILE_STAGES or args.profile or bool(args.profile_out)
+        PROFILE_OUT = args.profile_out or PROFILE_OUT
+        FAST_ROI = FAST_ROI or args.fast_roi
+        REDUCED_DECODE = REDUCED_DECODE or args.reduced_decode
+        CAPTURE_URL = args.capture_url or CAPTURE_URL
+        STREAM_URL_PRIMARY = args.stream_url or STREAM_URL_PRIMARY
+        STREAM_URL_BACKUP = args.stream_backup_url or STREAM_URL_BACKUP
+        SERIAL_PORT = args.serial_port or SERIAL_PORT
+        AUTOSTART_STREAM = AUTOSTART_STREAM or args.autostart
+        ADAPTIVE_TRACKING = ADAPTIVE_TRACKING or args.adaptive_tracking
+        TRACK_STABLE_STRIDE = args.track_stride or TRACK_STABLE_STRIDE
+        root = tk.Tk()
+        app = PalmPass(root)
+        root.mainloop()
+        gallery.compact()  # Drop the rows of students deleted this session
\ No newline at end of file
@@ -0,0 +1,514 @@
+import argparse
+import bisect
+import heapq
+import itertools
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# =============================================================================
+# Local stand-in for the ESP32 CameraWebServer (app_httpd.cpp) so the capture
+# path can be exercised without hardware:
+#   python palm_pass_standin.py captures/ --port 8080
+#   python palm_pass_processing_v2.py --capture-url http://127.0.0.1:8080/capture
+# plus a recorded preview on /stream (curl http://<esp>:81/stream > rec.mjpeg):
+#   python palm_pass_standin.py captures/ --stream rec.mjpeg --fps 20
+# or a recorded session, whose captures follow the stream's playback position:
+#   python palm_pass_standin.py --record session1/ --esp 192.168.1.40 --capture-at 3
+#   python palm_pass_standin.py --session session1/
+# and for the PalmVeinSystem LCD board (POSIX only, over a pseudo-terminal):
+#   python palm_pass_standin.py --lcd
+# End-to-end scan latency of the PalmPass app over recorded sessions:
+#   python palm_pass_standin.py --bench-replay session1/ session2/ --runs 3
+# CPU use of the headless station hub as stations are added, each on its own stand-in:
+#   python palm_pass_standin.py --bench-stations 1,2,4 --recordings rec.mjpeg
+# =============================================================================
+
+PART_BOUNDARY = "123456789000000000000987654321"   # Same multipart framing as app_httpd.cpp
+
+def read_mjpeg(path):
+    """JPEG frames of a recorded MJPEG stream (raw or multipart, as saved by curl) or of a directory of frames."""
+    path = Path(path)
+    if path.is_dir(): return [p.read_bytes() for p in sorted(path.glob("*.jp*g"))]
+    data = path.read_bytes()
+    frames, start = [], data.find(b"\xff\xd8")
+    while start >= 0:
+        end = data.find(b"\xff\xd9", start + 2)
+        if end < 0: break
+        frames.append(data[start:end + 2])
+        start = data.find(b"\xff\xd8", end + 2)
+    return frames
+
+def load_session(path):
+    """(stream frames, capture JPEGs, preview frame index of each capture) of a session directory holding
+    stream.mjpeg (or stream/ frames) and capture_<frame>.jpg files taken while that preview frame was live."""
+    path = Path(path)
+    stream = path / "stream.mjpeg" if (path / "stream.mjpeg").exists() else path / "stream"
+    frames = read_mjpeg(stream)
+    captures = []
+    for f in path.glob("capture*.jp*g"):
+        m = re.search(r"(\d+)$", f.stem)
+        captures.append((int(m.group(1)) if m else 0, f.read_bytes()))
+    if not frames or not captures: raise ValueError(f"{path}: needs stream.mjpeg and at least one capture_<frame>.jpg")
+    captures.sort(key=lambda c: c[0])
+    return frames, [c[1] for c in captures], [c[0] for c in captures]
+
+def record_session(stream_url, capture_url, out_dir, seconds=10.0, capture_at=(3.0,), size="UXGA"):
+    """Saves the live stream to out_dir/stream.mjpeg and a /capture at each capture_at second, named by
+    the preview frame that was current when it was requested."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    frames = [0]
+    stop = threading.Event()
+
+    def grab():
+        start = time.monotonic()
+        for at in capture_at:
+            if stop.wait(max(0.0, start + at - time.monotonic())): return
+            frame = frames[0]
+            with urllib.request.urlopen(f"{capture_url}?size={size}", timeout=10) as resp: data = resp.read()
+            (out_dir / f"capture_{frame:05d}.jpg").write_bytes(data)
+
+    grabber = threading.Thread(target=grab, daemon=True)
+    deadline = time.monotonic() + seconds
+    with urllib.request.urlopen(stream_url, timeout=10) as resp, open(out_dir / "stream.mjpeg", "wb") as out:
+        grabber.start()
+        tail = b""
+        while time.monotonic() < deadline:
+            chunk = resp.read(16384)
+            if not chunk: break
+            out.write(chunk)
+            frames[0] += (tail + chunk).count(b"\xff\xd8")   # SOI markers seen so far, including one split across chunks
+            tail = chunk[-1:]
+    stop.set()
+    grabber.join(timeout=10)
+    return frames[0]
+
+class StandInCamera:
+    """Serves JPEG files from disk on /capture, cycling through them, over keep-alive HTTP/1.1.
+
+    Given stream frames it also serves /stream as multipart MJPEG at fps, looping, one playback per client.
+    With capture_frames (the preview frame index of each JPEG) /capture returns the latest capture taken at
+    or before the frame the stream is currently playing, as a recorded session would have seen it.
+    """
+    def __init__(self, jpegs, host="127.0.0.1", port=0, latency=0.0, stream=None, fps=20.0, capture_frames=None):
+        self.jpegs = [Path(p).read_bytes() if not isinstance(p, bytes) else p for p in jpegs]
+        if not self.jpegs: raise ValueError("No JPEGs to serve")
+        self.latency = latency       # Seconds added before each response, like the LED/sensor delay
+        self.stream = list(stream or [])
+        self.fps = fps
+        self.capture_frames = list(capture_frames) if capture_frames else None
+        self.position = 0            # Recording index of the last stream frame sent
+        self.frames_sent = 0
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.cycle = itertools.cycle(range(len(self.jpegs)))
+        self.connections = 0         # TCP connections accepted, to check keep-alive reuse
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self): return f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+
+    @property
+    def capture_url(self): return f"{self.url}/capture"
+
+    @property
+    def stream_url(self): return f"{self.url}/stream"
+
+    def next_jpeg(self):
+        with self.lock:
+            self.requests += 1
+            if self.capture_frames: return self.jpegs[max(0, bisect.bisect_right(self.capture_frames, self.position) - 1)]
+            return self.jpegs[next(self.cycle)]
+
+    def _handler(self):
+        camera = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with camera.lock: camera.connections += 1
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/x-mixed-replace;boundary={PART_BOUNDARY}")
+                self.send_header("X-Framerate", str(int(camera.fps)))
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                interval, due = 1.0 / camera.fps, time.monotonic()
+                for index, frame in itertools.cycle(enumerate(camera.stream)):
+                    if camera.stop_event.is_set(): return
+                    now = time.time()
+                    part = (f"\r\n--{PART_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame)}\r\n"
+                            f"X-Timestamp: {int(now)}.{int(now % 1 * 1e6):06d}\r\n\r\n").encode()
+                    try: self.wfile.write(part + frame)
+                    except OSError: return  # Client went away
+                    with camera.lock:
+                        camera.frames_sent += 1
+                        camera.position = index
+                    due += interval
+                    camera.stop_event.wait(max(0.0, due - time.monotonic()))
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/stream" and camera.stream:
+                    self._stream()
+                    return
+                if path != "/capture":
+                    self.send_error(404)
+                    return
+                if camera.latency: time.sleep(camera.latency)
+                body = camera.next_jpeg()
+                now = time.time()
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("X-Timestamp", f"{int(now)}.{int(now % 1 * 1e6):06d}")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args): pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
+
+class StandInLcd:
+    """Pseudo-terminal that answers like PalmVeinSystem.ino: READY after a reset delay, ACK:<cmd> per line."""
+    def __init__(self, reset_delay=0.0, ack=True, apply_delay=0.0):
+        import pty, tty  # POSIX only
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.reset_delay = reset_delay
+        self.ack = ack                # False behaves like firmware without acknowledgements
+        self.apply_delay = apply_delay
+        self.commands = []            # (monotonic time, "COMMAND:DATA") in arrival order
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def screens(self): return [line for _, line in self.commands if not line.startswith("IR_")]
+
+    def _run(self):
+        if self.reset_delay: time.sleep(self.reset_delay)
+        os.write(self.master, b"READY\r\n")
+        buf = b""
+        while not self.stop_event.is_set():
+            try: chunk = os.read(self.master, 1024)
+            except OSError: break
+            buf += chunk
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                line = line.decode().strip()
+                self.commands.append((time.monotonic(), line))
+                if self.apply_delay: time.sleep(self.apply_delay)
+                if self.ack: os.write(self.master, f"ACK:{line.split(':', 1)[0]}\r\n".encode())
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for fd in (self.master, self.slave):
+            try: os.close(fd)
+            except OSError: pass
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc): self.stop()
+
+class StubFirestore:
+    """Just enough of a Firestore client for FirestoreWriter: batches commit after a simulated round trip."""
+    class _Ref:
+        def __init__(self, path): self.path = path
+        def document(self, doc_id): return StubFirestore._Ref(f"{self.path}/{doc_id}")
+
+    class _Batch:
+        def __init__(self, client):
+            self.client = client
+            self.ops = 0
+        def set(self, ref, data, merge=False): self.ops += 1
+        def update(self, ref, data): self.ops += 1
+        def delete(self, ref): self.ops += 1
+        def commit(self):
+            time.sleep(self.client.latency)
+            self.client.committed += self.ops
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.committed = 0
+    def collection(self, name): return self._Ref(name)
+    def batch(self): return self._Batch(self)
+
+class StubWidget:
+    """Swallows any Tk widget or messagebox call."""
+    def __getattr__(self, name): return lambda *args, **kwargs: None
+
+class StubVar:
+    """Plain value holder for a Tk variable; Tcl variables can't be read off the main loop without a display."""
+    def __init__(self, value=""): self.value = value
+    def get(self): return self.value
+    def set(self, value): self.value = value
+
+class StubRoot:
+    """Stands in for the Tk root: after() callbacks run on the thread that calls run(), like the Tk mainloop."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = []            # (due, id, callback, args)
+        self.ids = itertools.count(1)
+        self.cancelled = set()
+
+    def title(self, *args): pass
+    def geometry(self, *args): pass
+    def configure(self, **kwargs): pass
+
+    def after(self, ms, callback, *args):
+        with self.lock:
+            job = next(self.ids)
+            heapq.heappush(self.queue, (time.monotonic() + ms / 1000, job, callback, args))
+        return job
+
+    def after_cancel(self, job):
+        with self.lock: self.cancelled.add(job)
+
+    def run(self, until, timeout):
+        """Runs due callbacks until until() is true or timeout seconds pass; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if until(): return True
+            with self.lock:
+                due = self.queue[0][0] if self.queue else None
+                if due is not None and due <= time.monotonic():
+                    _, job, callback, args = heapq.heappop(self.queue)
+                    if job in self.cancelled:
+                        self.cancelled.discard(job)
+                        continue
+                else: callback = None
+            if callback: callback(*args)
+            else: time.sleep(0.002)
+        return until()
+
+def headless_app(pp, root):
+    """A PalmPass whose widgets are stubs: capture, tracking, matching and writes run unchanged."""
+    class HeadlessPalmPass(pp.PalmPass):
+        def __init__(self, root):
+            self.errors = []
+            super().__init__(root)
+            self.mode, self.exam_subject = StubVar(self.mode.get()), StubVar()   # Read from the capture thread
+
+        def build_gui(self):
+            for name in ("stream_btn", "auto_btn", "capture_btn", "undo_btn", "status_label", "result_label",
+                         "log_text", "video_canvas", "dynamic_frame"):
+                setattr(self, name, StubWidget())
+            self.ready_labels = {name: StubWidget() for name in self.SUBSYSTEMS}
+
+        def start_subsystems(self): self.tracker = pp.HandTracker()   # Firebase, gallery and LCD are set up by the caller
+
+        def log(self, msg, color=None):
+            if msg.startswith("Error"): self.errors.append(msg)
+            print(f"  {msg}")
+
+        def show_frame(self, frame): pass   # Rendering needs a display; not measured
+
+    return HeadlessPalmPass(root)
+
+REPLAY_PHASES = ("ready", "capture", "extract", "match", "write", "scan", "total")
+
+def replay_benchmark(sessions, runs=3, fps=20.0, firestore_latency=0.05, timeout=30.0):
+    """End-to-end scan latency of the PalmPass app over recorded sessions replayed by a StandInCamera.
+
+    Each run builds a fresh PalmPass on a StubRoot in exam mode with auto-capture on, streams one session into
+    it and waits for its first scan: update_loop -> perform_capture -> extraction -> handle_scan ->
+    attendance write -> LCD. Firestore is a StubFirestore behind a throwaway journal, the LCD a StandInLcd
+    where available, and the roster every enrolled student, Pending. Returns ({phase: [ms, ...]},
+    [(session, run, LCD result or failure), ...]).
+    """
+    import tkinter
+    import palm_pass_processing_v2 as pp
+    pp.gallery.ensure_loaded()
+    saved = {name: getattr(pp, name) for name in ("db", "writer", "lcd", "messagebox", "CAPTURE_URL",
+                                                  "STREAM_URL_PRIMARY", "STREAM_URL_BACKUP")}
+    if tkinter._default_root is None: tkinter._default_root = tkinter.Tcl()   # Tk variables without a display
+    scratch = Path(tempfile.mkdtemp(prefix="palmpass-bench-"))
+    stub = StubFirestore(firestore_latency)
+    pp.db, pp.messagebox = stub, StubWidget()
+    pp.writer = pp.FirestoreWriter(pp.WriteJournal(scratch / "journal.sqlite"), client=lambda: stub).start()
+    phases, outcomes = {p: [] for p in REPLAY_PHASES}, []
+    try:
+        for session in sessions:
+            frames, captures, capture_frames = load_session(session)
+            for run in range(runs):
+                camera = StandInCamera(captures, stream=frames, fps=fps, capture_frames=capture_frames).start()
+                board = StandInLcd().start() if os.name == "posix" else None
+                pp.lcd = pp.LcdWriter(board.port).start() if board else StubWidget()   # Never the real SERIAL_PORT
+                pp.CAPTURE_URL, pp.STREAM_URL_PRIMARY = camera.capture_url, camera.stream_url
+                pp.STREAM_URL_BACKUP = camera.stream_url
+                print(f"{Path(session).name} #{run + 1}")
+                root = StubRoot()
+                app = headless_app(pp, root)
+                app.mode.set("exam")
+                app.exam_subject.set("BENCH")
+                entries = {m: {"matric_no": m, "exam_id": "BENCH", "status": "Pending", "table_no": str(i + 1)}
+                           for i, m in enumerate(pp.store.students())}
+                app.roster = pp.ExamRoster("BENCH", entries)
+                app.start_stream()
+                app.toggle_auto()
+                root.run(lambda: app.scan_timings or app.errors, timeout)
+                if app.scan_timings:
+                    timing = app.scan_timings[0]
+                    for p in REPLAY_PHASES: phases[p].append(timing[p])
+                    outcomes.append((session, run + 1, timing["result"]))
+                else: outcomes.append((session, run + 1, app.errors[0] if app.errors else "timeout"))
+                app.stop_stream()
+                app.capture_client.close()
+                app.tracker.close()
+                pp.lcd.close()
+                camera.stop()
+                if board: board.stop()
+    finally:
+        pp.writer.stop()
+        pp.writer.journal.close()
+        for name, value in saved.items(): setattr(pp, name, value)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return phases, outcomes
+
+def station_cpu_benchmark(recordings, counts=(1, 2, 4), seconds=15.0, fps=20.0, workers=None, warmup=3.0):
+    """CPU use as stations are added, each replaying a recorded MJPEG stream from its own StandInCamera.
+
+    CPU is this process only (stream decode, tracking, matching); extraction in the pool workers is not counted.
+    """
+    import numpy as np
+    import palm_pass_processing_v2 as pp
+    streams = [read_mjpeg(p) for p in recordings]
+    if not all(streams): raise ValueError("A recording holds no JPEG frames")
+    rows = []
+    for n in counts:
+        cameras = [StandInCamera(streams[i % len(streams)], stream=streams[i % len(streams)], fps=fps).start() for i in range(n)]
+        config = [{"name": f"bench-{i + 1}", "capture_url": cam.capture_url, "stream_urls": [cam.stream_url], "mode": "identify"}
+                  for i, cam in enumerate(cameras)]
+        hub = pp.StationHub(config, workers).start()
+        hub.run(warmup, report_every=0)
+        cpu, wall = time.process_time(), time.perf_counter()
+        hub.run(seconds, report_every=0)
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        stats = hub.stats()
+        hub.stop()
+        for cam in cameras: cam.stop()
+        rows.append({"stations": n, "cpu_pct": 100 * cpu / wall, "cpu_per_station": 100 * cpu / wall / n,
+                     "cam_fps": float(np.mean([s["cam_fps"] for s in stats])), "track_fps": float(np.mean([s["track_fps"] for s in stats])),
+                     "infer_ms": float(np.mean([s["infer_ms"] for s in stats])), "captures": sum(s["captures"] for s in stats)})
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve JPEGs like the ESP32 /capture endpoint")
+    parser.add_argument("source", nargs="?", help="JPEG file or directory of JPEGs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of simulated sensor delay per capture")
+    parser.add_argument("--stream", metavar="MJPEG", help="recorded MJPEG file (or directory of frames) to serve on /stream")
+    parser.add_argument("--fps", type=float, default=20.0, help="/stream playback rate")
+    parser.add_argument("--session", metavar="DIR", help="serve a recorded session (stream.mjpeg + capture_<frame>.jpg)")
+    parser.add_argument("--record", metavar="DIR", help="instead, record a session from a live ESP32 into DIR")
+    parser.add_argument("--esp", default="192.168.1.40", help="ESP32 address for --record")
+    parser.add_argument("--seconds", type=float, default=10.0, help="--record length")
+    parser.add_argument("--capture-at", type=float, nargs="+", default=[3.0], metavar="S", help="--record a UXGA capture S seconds in")
+    parser.add_argument("--bench-replay", nargs="+", metavar="SESSION", help="instead, measure PalmPass scan latency over recorded sessions")
+    parser.add_argument("--runs", type=int, default=3, help="replays per session for --bench-replay")
+    parser.add_argument("--firestore-latency", type=float, default=0.05, help="simulated commit round trip (s) for --bench-replay")
+    parser.add_argument("--bench-stations", metavar="N,N,...", help="instead, measure CPU use with N stations replaying --recordings, e.g. 1,2,4")
+    parser.add_argument("--recordings", nargs="+", metavar="MJPEG", help="recorded MJPEG streams (or frame directories) for --bench-stations")
+    parser.add_argument("--bench-seconds", type=float, default=15.0, help="measurement window per station count for --bench-stations")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes for --bench-stations (default: CPU count)")
+    parser.add_argument("--fast-roi", action="store_true", help="benchmark with the decimated ROI fast path")
+    parser.add_argument("--reduced-decode", action="store_true", help="benchmark with reduced-scale capture decoding")
+    parser.add_argument("--adaptive-tracking", action="store_true", help="benchmark with crop tracking and frame skipping")
+    parser.add_argument("--track-stride", type=int, default=None, metavar="N", help="with --adaptive-tracking, infer on 1 of N frames while stable")
+    parser.add_argument("--lcd", action="store_true", help="instead, emulate the LCD board on a pseudo-terminal and echo its commands")
+    args = parser.parse_args()
+
+    if args.lcd:
+        board = StandInLcd(reset_delay=2.0).start()
+        print(f"LCD board on {board.port}; run palm_pass_processing_v2.py --serial-port {board.port}")
+        seen = 0
+        try:
+            while True:
+                time.sleep(0.1)
+                for _, line in board.commands[seen:]: print(line)
+                seen = len(board.commands)
+        except KeyboardInterrupt:
+            board.stop()
+        raise SystemExit
+    if args.bench_replay or args.bench_stations:
+        import numpy as np
+        import palm_pass_processing_v2 as pp
+        pp.FAST_ROI = pp.FAST_ROI or args.fast_roi
+        pp.REDUCED_DECODE = pp.REDUCED_DECODE or args.reduced_decode
+        pp.ADAPTIVE_TRACKING = pp.ADAPTIVE_TRACKING or args.adaptive_tracking
+        pp.TRACK_STABLE_STRIDE = args.track_stride or pp.TRACK_STABLE_STRIDE
+    if args.bench_stations:
+        if not args.recordings: parser.error("--bench-stations needs --recordings")
+        print(f"{'stations':>8} {'cpu %':>7} {'cpu/stn':>8} {'cam fps':>8} {'trk fps':>8} {'infer ms':>9} {'captures':>9}")
+        for row in station_cpu_benchmark(args.recordings, [int(n) for n in args.bench_stations.split(",")],
+                                         args.bench_seconds, args.fps, args.workers):
+            print(f"{row['stations']:>8} {row['cpu_pct']:>7.1f} {row['cpu_per_station']:>8.1f} {row['cam_fps']:>8.1f} "
+                  f"{row['track_fps']:>8.1f} {row['infer_ms']:>9.1f} {row['captures']:>9}")
+        raise SystemExit
+    if args.bench_replay:
+        phases, outcomes = replay_benchmark(args.bench_replay, args.runs, args.fps, args.firestore_latency)
+        for session, run, result in outcomes: print(f"{session} #{run}: {result}")
+        print(f"{'phase':>8} {'n':>4} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}  (ms)")
+        for phase, values in phases.items():
+            if not values: continue
+            v = np.array(values)
+            print(f"{phase:>8} {len(v):>4} {v.mean():>8.1f} {np.percentile(v, 50):>8.1f} {np.percentile(v, 95):>8.1f} {v.max():>8.1f}")
+        raise SystemExit
+    if args.record:
+        count = record_session(f"http://{args.esp}:81/stream", f"http://{args.esp}/capture", args.record, args.seconds, args.capture_at)
+        print(f"Recorded {count} frames and {len(args.capture_at)} captures into {args.record}")
+        raise SystemExit
+    if args.session:
+        frames, captures, indices = load_session(args.session)
+        camera = StandInCamera(captures, args.host, args.port, args.latency, frames, args.fps, indices).start()
+        print(f"Replaying {args.session}: {len(frames)} frames on {camera.stream_url}, captures at frames {indices} on {camera.capture_url}")
+        try:
+            while True: time.sleep(1)
+        except KeyboardInterrupt:
+            camera.stop()
+        raise SystemExit
+    if not args.source: parser.error("source is required unless --lcd, --record or --session is given")
+
+    source = Path(args.source)
+    files = sorted(source.glob("*.jp*g")) if source.is_dir() else [source]
+    stream = read_mjpeg(args.stream) if args.stream else None
+    camera = StandInCamera(files, args.host, args.port, args.latency, stream, args.fps).start()
+    print(f"Serving {len(files)} JPEGs on {camera.capture_url}")
+    if stream: print(f"Serving {len(stream)} recorded frames on {camera.stream_url} at {args.fps:g} fps")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        camera.stop()
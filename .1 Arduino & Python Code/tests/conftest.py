@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scripts are not a package; make them importable from here
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,180 @@
+import json
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+import pytest
+
+import palm_pass_processing_v2 as pp
+
+
+# ==================== FEATURE VECTOR ====================
+def test_calculate_vector_matches_reference():
+    extractor = pp.VeinFeatureExtractor()
+    rng = np.random.default_rng(0)
+    skels = [(pp.morphology.thin(rng.random((pp.ROI_SIZE, pp.ROI_SIZE)) > p) * 255).astype(np.uint8) for p in (0.4, 0.6, 0.9)]
+    skels.append(np.zeros((pp.ROI_SIZE, pp.ROI_SIZE), np.uint8))
+    for skel in skels:
+        fast, ref = extractor._calculate_vector(skel), extractor._calculate_vector_reference(skel)
+        assert fast.dtype == ref.dtype and fast.shape == (pp.VECTOR_DIM,)
+        assert fast.tobytes() == ref.tobytes()
+
+
+# ==================== TEMPLATE STORE ====================
+def write_legacy_index(root, students):
+    """Legacy student_index.json plus vec_*.npy files under root; returns {matric: [vectors]}."""
+    rng = np.random.default_rng(1)
+    index, vectors = {}, {}
+    for matric in students:
+        templates = []
+        for k in range(2):
+            vec = rng.random(pp.VECTOR_DIM).astype(np.float32)
+            path = root / "templates" / matric / "primary" / f"vec_{k}.npy"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            np.save(path, vec)
+            templates.append({"path": str(path), "img_path": str(path.with_suffix(".jpg")), "hand": "primary"})
+            vectors.setdefault(matric, []).append(vec)
+        index[matric] = {"name": f"Student {matric}", "faculty": "FTMK", "program": "BITS", "templates": templates}
+    with open(root / pp.INDEX_FILE.name, "w") as f: json.dump(index, f)
+    return vectors
+
+def store_contents(store):
+    vectors = store.vectors()
+    return {m: sorted(vectors[t["row"]].tobytes() for t in info["templates"]) for m, info in store.students().items()}
+
+def test_store_migrate_delete_reopen(tmp_path):
+    legacy = write_legacy_index(tmp_path, ["A001", "A002", "A003"])
+    store = pp.TemplateStore(tmp_path)
+    assert store_contents(store) == {m: sorted(v.tobytes() for v in vecs) for m, vecs in legacy.items()}
+    assert store.migrated and (tmp_path / pp.INDEX_FILE.name).exists()
+
+    new_vec = np.full(pp.VECTOR_DIM, 0.5, np.float32)
+    store.append("A004", "Student A004", "FTMK", "BITS", "primary", new_vec, tmp_path / "img.jpg")
+    assert store.delete("A002")
+    assert not store.delete("A002")
+    expected = store_contents(store)
+    assert set(expected) == {"A001", "A003", "A004"} and store.dead_rows == 2
+
+    # Reopening replays the record log and must not import the legacy index a second time
+    reopened = pp.TemplateStore(tmp_path)
+    assert store_contents(reopened) == expected
+    assert reopened.rows == store.rows and reopened.dead_rows == 2
+
+    reopened.compact()
+    assert store_contents(reopened) == expected
+    assert reopened.dead_rows == 0 and reopened.rows == 5
+    assert store_contents(pp.TemplateStore(tmp_path)) == expected
+    assert sorted(p.name for p in tmp_path.glob("vectors_*.f32")) == [reopened.vector_file.name]
+
+def test_store_drops_torn_append(tmp_path):
+    store = pp.TemplateStore(tmp_path)
+    store.append("A001", "Student A001", "FTMK", "BITS", "primary", np.ones(pp.VECTOR_DIM, np.float32), "img.jpg")
+    with open(store.vector_file, "ab") as f: f.write(b"\0" * 10)
+    with open(store.record_file, "a") as f: f.write('{"op": "add", "matric": "A0')
+    reopened = pp.TemplateStore(tmp_path)
+    assert list(reopened.students()) == ["A001"] and reopened.rows == 1
+
+
+# ==================== CAPTURE DECODE ====================
+@pytest.fixture(scope="module")
+def capture_jpeg():
+    rng = np.random.default_rng(2)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (5, 5), 0)
+    ok, data = cv2.imencode(".jpg", img)
+    assert ok
+    return data.tobytes()
+
+def baseline_crop(data, bbox):
+    """What perform_capture did before decode_capture: flip the whole frame, then slice the red channel."""
+    frame = cv2.flip(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR), 1)
+    x, y, w, h = bbox
+    return frame[max(0, y):y + h, max(0, x):x + w, 2]
+
+@pytest.mark.parametrize("bbox", [(100, 80, 300, 250), (0, 0, 640, 480), (-20, -10, 200, 150), (500, 400, 300, 200)])
+def test_decode_capture_matches_flip_then_crop(capture_jpeg, bbox):
+    crop, factor = pp.decode_capture(capture_jpeg, bbox, reduce=False)
+    assert factor == 1
+    np.testing.assert_array_equal(crop, baseline_crop(capture_jpeg, bbox))
+
+def test_decode_capture_maps_preview_bbox(capture_jpeg):
+    bbox = (40, 30, 120, 100)
+    crop, _ = pp.decode_capture(capture_jpeg, bbox, reduce=False, source_size=(320, 240))
+    np.testing.assert_array_equal(crop, baseline_crop(capture_jpeg, pp.map_bbox(bbox, (320, 240), (640, 480))))
+
+def test_decode_capture_outside_frame(capture_jpeg):
+    assert pp.decode_capture(capture_jpeg, (700, 10, 50, 50), reduce=False) == (None, 1)
+
+
+# ==================== WRITE JOURNAL ====================
+class FakeFirestore:
+    """Records committed writes as (kind, collection, doc, data, merge)."""
+    def __init__(self):
+        self.committed = []
+
+    def collection(self, name): return FakeCollection(name)
+    def batch(self): return FakeBatch(self)
+
+class FakeCollection:
+    def __init__(self, name): self.name = name
+    def document(self, doc_id): return (self.name, doc_id)
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.ops = []
+
+    def set(self, ref, data, merge=False): self.ops.append(("set", *ref, data, merge))
+    def update(self, ref, data): self.ops.append(("update", *ref, data, False))
+    def delete(self, ref): self.ops.append(("delete", *ref, None, False))
+    def commit(self): self.client.committed.extend(self.ops)
+
+def test_journal_replays_after_restart(tmp_path):
+    path = tmp_path / "pending_writes.sqlite"
+    stamp = datetime(2026, 1, 13, 9, 30, tzinfo=timezone.utc)
+    offline = pp.FirestoreWriter(pp.WriteJournal(path), client=lambda: None)
+    offline.set("ATTENDANCE", "E1_A001", {"status": "PRESENT", "time": stamp})
+    offline.update("ATTENDANCE", "E1_A001", {"status": "BATHROOM"})
+    offline.set("STUDENTS", "A002", {"name": "Student A002"}, merge=True)
+    offline.delete("STUDENTS", "A003")
+    assert offline.pending_docs("ATTENDANCE") == {"E1_A001": {"status": "BATHROOM", "time": {"$datetime": stamp.isoformat()}}}
+    assert offline.journal.counts() == (4, 0)
+    offline.journal.close()  # Process dies before anything is sent
+
+    client = FakeFirestore()
+    journal = pp.WriteJournal(path)
+    writer = pp.FirestoreWriter(journal, client=lambda: client, flush_delay=0.01).start()
+    try:
+        assert writer.flush(timeout=5)
+    finally:
+        writer.stop()
+    assert client.committed == [
+        ("set", "ATTENDANCE", "E1_A001", {"status": "PRESENT", "time": stamp}, False),
+        ("update", "ATTENDANCE", "E1_A001", {"status": "BATHROOM"}, False),
+        ("set", "STUDENTS", "A002", {"name": "Student A002"}, True),
+        ("delete", "STUDENTS", "A003", None, False),
+    ]
+    assert journal.counts() == (0, 0) and writer.pending_docs("ATTENDANCE") == {}
+    journal.close()
+
+def test_journal_keeps_ops_until_commit_succeeds(tmp_path, monkeypatch):
+    monkeypatch.setattr(pp, "FIRESTORE_RETRY_MAX", 0.05)
+    client = FakeFirestore()
+    attempts = []
+
+    def flaky_commit():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3: raise ConnectionError("offline")
+        client.committed.append("batch")
+    client.batch = lambda: type("Batch", (), {"set": lambda *a, **k: None, "commit": staticmethod(flaky_commit)})()
+
+    journal = pp.WriteJournal(tmp_path / "pending_writes.sqlite")
+    writer = pp.FirestoreWriter(journal, client=lambda: client, flush_delay=0.01, on_event=lambda msg: None).start()
+    try:
+        writer.set("ATTENDANCE", "E1_A001", {"status": "PRESENT"})
+        assert writer.flush(timeout=5)
+    finally:
+        writer.stop()
+    assert len(attempts) == 3 and client.committed == ["batch"]
+    assert journal.counts() == (0, 0) and writer.failures == 0
+    journal.close()